@@ -28,5 +28,8 @@ setup(
         'opencc',
         'tai5-uan5_gian5-gi2_kang1-ku7',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     include_package_data=True,
 )
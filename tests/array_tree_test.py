@@ -0,0 +1,41 @@
+import unittest
+
+from nltk.tree import Tree
+
+from tsm.array_tree import ArrayTree
+from tsm.chinese_head_finder import ChineseSemanticHeadFinder
+from tsm.util import is_preterminal, path_compression
+
+
+class TestArrayTree(unittest.TestCase):
+    def setUp(self):
+        self.bracketed = "(ROOT (IP (NP (PN 伊)) (VP (VC 是) (NP (ADJP (JJ 誠巧)) (NP (NN 囡仔))))))"
+        self.tree = ArrayTree.fromstring(self.bracketed)
+
+    def test_matches_nltk_tree(self):
+        nltk_tree = Tree.fromstring(self.bracketed)
+        self.assertEqual(self.tree.to_tree(), nltk_tree)
+        self.assertEqual(self.tree.leaves(), nltk_tree.leaves())
+        self.assertEqual(self.tree.treepositions(), nltk_tree.treepositions())
+        self.assertEqual(ArrayTree.from_tree(nltk_tree).__dict__, ArrayTree.fromstring(self.bracketed).__dict__)
+        vp = self.tree.treepositions().index((0, 1))
+        self.assertEqual(self.tree.label(vp), "VP")
+        self.assertEqual(self.tree.leaves(vp), ["是", "誠巧", "囡仔"])
+        self.assertEqual([self.tree.label(child) for child in self.tree.children(vp)], ["VC", "NP"])
+        self.assertTrue(is_preterminal(self.tree, self.tree.first_child[vp]))
+        self.assertFalse(is_preterminal(self.tree, vp))
+        with self.assertRaises(ValueError):
+            ArrayTree.fromstring("(IP (NP 伊)")
+
+    def test_head_finder_on_arrays(self):
+        head_finder = ChineseSemanticHeadFinder()
+        nltk_tree = Tree.fromstring(self.bracketed)
+        positions = self.tree.treepositions()
+        for node in range(len(self.tree)):
+            if not self.tree.is_leaf(node) and not self.tree.is_preterminal(node):
+                head = head_finder.determine_array_head(self.tree, node)
+                subtree = nltk_tree[positions[node]]
+                self.assertIs(nltk_tree[positions[head]], head_finder.determine_head(subtree, None))
+
+    def test_path_compression(self):
+        self.assertEqual(path_compression({1: 2, 2: 3, 5: 1}), {1: 3, 2: 3, 5: 3})
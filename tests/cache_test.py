@@ -0,0 +1,44 @@
+
+from tsm.cache import LRUCache, SqliteCache, build_cache
+from tsm.test_case import TSMTestCase
+
+
+class TestCache(TSMTestCase):
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+
+    def test_tiered_cache_persists_to_disk(self):
+        path = str(self.TEST_DIR / "cache.sqlite")
+        cache = build_cache(maxsize=1, path=path)
+        cache.put("伊是一个誠巧的囡仔", ({"tree": "(IP (NP (PN 他)))"}, ["i1"]))
+        cache.put(("word", 1), ["entry"])
+
+        reopened = build_cache(maxsize=1, path=path)
+        assert reopened.get("伊是一个誠巧的囡仔") == ({"tree": "(IP (NP (PN 他)))"}, ["i1"])
+        assert reopened.get(("word", 1)) == ["entry"]
+        assert reopened.get(("word", 2)) is None
+        assert reopened.tiers[1].stats.hits == 2
+        assert reopened.stats.misses == 1
+        assert isinstance(reopened.tiers[1], SqliteCache)
+
+    def test_invalidate_and_clear_every_tier(self):
+        path = str(self.TEST_DIR / "cache.sqlite")
+        cache = build_cache(maxsize=2, path=path)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.invalidate(["a", "c"])
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert build_cache(maxsize=2, path=path).get("a") is None
+
+        cache.clear()
+        assert cache.get("b") is None
+        assert build_cache(maxsize=2, path=path).get("b") is None
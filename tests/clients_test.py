@@ -0,0 +1,233 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import asyncio
+import json
+import socket
+import threading
+import time
+import unittest
+import xmlrpc.client
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from tsm.clients import AllennlpClient, MosesClient, PoolConfig, UnkTranslator
+from tsm.clients import AsyncAllennlpClient, AsyncMosesClient
+from tsm.lexicon import Lexicon, LexiconEntry
+from tsm.symbols import Stratum
+
+
+class TestUnkTranslator(unittest.TestCase):
+    def setUp(self):
+        prob_lexicon = Lexicon([LexiconEntry("伊", 0.0, "i1")])
+        dict_lexicon = Lexicon([LexiconEntry("囡仔", 0.0, "gin2 a2")])
+        taibun_lexicon = Lexicon([LexiconEntry("醫", 0.0, "i1", Stratum.文),
+                                  LexiconEntry("醫", -1.0, "ui1", Stratum.白)])
+        self.translator = UnkTranslator(prob_lexicon, dict_lexicon, taibun_lexicon,
+                                        ["prob", "dict", "bpmf"], None, cache_size=10)
+
+    def test_translate_is_memoized(self):
+        hyps = self.translator.translate("衣", 2)
+        self.assertEqual([(hyp.grapheme, hyp.phonemes) for hyp in hyps], [("衣", "i1"), ("衣", "ui1")])
+        hyps.pop()
+        cached_hyps = self.translator.translate("衣", 2)
+        self.assertEqual([hyp.phonemes for hyp in cached_hyps], ["i1", "ui1"])
+        self.assertEqual(self.translator.cache.stats.hits, 1)
+
+    def test_invalidate_after_lexicon_update(self):
+        self.assertEqual([hyp.phonemes for hyp in self.translator.translate("伊", 1)], ["i1"])
+        self.assertEqual([hyp.phonemes for hyp in self.translator.translate("伊", 2)], ["i1"])
+        self.assertEqual((self.translator.cache.stats.hits, self.translator.cache.stats.misses), (0, 2))
+        touched = self.translator.prob_lexicon.add_entries([LexiconEntry("伊", 0.0, "i7")])
+        self.assertEqual([hyp.phonemes for hyp in self.translator.translate("伊", 2)], ["i1"])
+
+        self.translator.invalidate(touched)
+        self.assertEqual(sorted(hyp.phonemes for hyp in self.translator.translate("伊", 2)), ["i1", "i7"])
+        self.assertEqual(len(self.translator.translate("伊", 1)), 1)
+
+    def test_bpmf_translate_leaves_lexicon_untouched(self):
+        self.translator.translate("衣", 1)
+        graphemes = {entry.grapheme for entries in self.translator.unk_lexicon.values() for entry in entries}
+        self.assertEqual(graphemes, {"ㄧ"})
+
+
+class KeepAliveXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class TestMosesClient(unittest.TestCase):
+    def setUp(self):
+        self.rpc_server = ThreadingXMLRPCServer(("localhost", 0), KeepAliveXMLRPCRequestHandler, logRequests=False)
+        self.rpc_server.register_function(lambda data: {"text": data["text"]}, "translate")
+        self.rpc_server.register_function(lambda: 1 / 0, "fail")
+        threading.Thread(target=self.rpc_server.serve_forever, args=(0.05,), daemon=True).start()
+        self.port = self.rpc_server.server_address[1]
+
+    def tearDown(self):
+        self.rpc_server.shutdown()
+        self.rpc_server.server_close()
+
+    def test_reuses_pooled_connection(self):
+        client = MosesClient(port=self.port, pool_config=PoolConfig(pool_size=2))
+        for sent in ["伊", "囡仔", "伊是"]:
+            self.assertEqual(client.translate(sent), {"text": " ".join(sent)})
+        self.assertEqual((client.stats.requests, client.stats.reconnects), (3, 1))
+        self.assertEqual(client._num_proxies, 1)
+
+    def test_pool_is_bounded(self):
+        client = MosesClient(port=self.port, pool_config=PoolConfig(pool_size=2))
+        results = []
+        with client.server(), client.server():
+            waiting = threading.Thread(target=lambda: results.append(client.translate("伊")))
+            waiting.start()
+            waiting.join(0.2)
+            self.assertTrue(waiting.is_alive())
+            self.assertEqual(client._num_proxies, 2)
+        waiting.join(5)
+        self.assertEqual(results, [{"text": "伊"}])
+        self.assertEqual(client._num_proxies, 2)
+
+    def test_retries_refused_connections(self):
+        client = MosesClient(port=free_port(), pool_config=PoolConfig(max_retries=2, backoff_factor=0.0))
+        with self.assertRaises(ConnectionRefusedError):
+            client.translate("伊")
+        self.assertEqual((client.stats.requests, client.stats.failures, client.stats.retries), (3, 3, 2))
+
+    def test_does_not_retry_faults(self):
+        client = MosesClient(port=self.port, pool_config=PoolConfig(max_retries=2, backoff_factor=0.0))
+        with self.assertRaises(xmlrpc.client.Fault):
+            client.call("fail")
+        self.assertEqual(client.stats.retries, 0)
+        self.assertEqual(client.call("translate", {"text": "伊"}), {"text": "伊"})
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(data)
+        if len(self.server.requests) <= self.server.num_unavailable:
+            status, body = 503, b""
+        else:
+            status = 200
+            body = json.dumps({"class_log_probabilities": [0.0], "predicted_tokens": [["i1"]]}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAllennlpClient(unittest.TestCase):
+    def setUp(self):
+        self.http_server = ThreadingHTTPServer(("localhost", 0), PredictionHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.requests = []
+        self.http_server.num_unavailable = 0
+        threading.Thread(target=self.http_server.serve_forever, args=(0.05,), daemon=True).start()
+        self.client = AllennlpClient(port=self.http_server.server_address[1],
+                                     pool_config=PoolConfig(backoff_factor=0.0))
+
+    def tearDown(self):
+        self.client.http_session.close()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def test_server_keeps_connection_alive(self):
+        for _ in range(3):
+            hyps = self.client.translate(["伊"])
+            self.assertEqual([(hyp.grapheme, hyp.phonemes) for hyp in hyps], [("伊", "i1")])
+        self.assertEqual(self.http_server.requests, [{"source": "伊"}] * 3)
+        self.assertEqual((self.client.stats.requests, self.client.stats.reconnects), (3, 1))
+
+    def test_server_retries_unavailable(self):
+        self.http_server.num_unavailable = 2
+        self.assertEqual(self.client.server({"source": "伊"}).status_code, 200)
+        self.assertEqual(len(self.http_server.requests), 3)
+        self.assertEqual((self.client.stats.requests, self.client.stats.retries), (1, 2))
+
+
+@unittest.skipIf(aiohttp is None, "needs the async extra")
+class TestAsyncClients(unittest.TestCase):
+    def setUp(self):
+        self.in_flight, self.max_in_flight = 0, 0
+        self.lock = threading.Lock()
+        self.rpc_server = ThreadingXMLRPCServer(("localhost", 0), KeepAliveXMLRPCRequestHandler, logRequests=False)
+        self.rpc_server.register_function(self.slow_translate, "translate")
+        self.http_server = ThreadingHTTPServer(("localhost", 0), PredictionHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.requests = []
+        self.http_server.num_unavailable = 0
+        for server in (self.rpc_server, self.http_server):
+            threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.moses_port = self.rpc_server.server_address[1]
+        self.allennlp_port = self.http_server.server_address[1]
+
+    def tearDown(self):
+        for server in (self.rpc_server, self.http_server):
+            server.shutdown()
+            server.server_close()
+
+    def slow_translate(self, data):
+        if data["text"] == "b a d":
+            raise ValueError(data["text"])
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        return {"text": data["text"], "nbest": data["nbest"]}
+
+    def test_moses_requests_are_bounded_by_max_concurrency(self):
+        sents = ["伊", "囡仔", "伊是", "好", "食飯", "誠好"]
+
+        async def translate_all():
+            async with AsyncMosesClient(port=self.moses_port, max_concurrency=2) as client:
+                results = await asyncio.gather(*[client.translate(sent) for sent in sents])
+                with self.assertRaises(xmlrpc.client.Fault):
+                    await client.translate("bad")
+                return results, client.session
+
+        results, session = asyncio.run(translate_all())
+        self.assertEqual(results, [{"text": " ".join(sent), "nbest": 5} for sent in sents])
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertTrue(session.closed)
+
+    def test_clients_share_a_borrowed_session(self):
+        async def translate_both():
+            async with aiohttp.ClientSession() as session:
+                moses = AsyncMosesClient(port=self.moses_port, session=session)
+                allennlp = AsyncAllennlpClient(port=self.allennlp_port, session=session)
+                translation, hyps = await asyncio.gather(moses.translate("伊"), allennlp.translate(["伊"]))
+                await moses.close()
+                await allennlp.close()
+                self.assertIs(moses.session, session)
+                self.assertIs(allennlp.session, session)
+                self.assertFalse(session.closed)
+                return moses, allennlp, translation, hyps
+
+        moses, allennlp, translation, hyps = asyncio.run(translate_both())
+        self.assertEqual(translation, {"text": "伊", "nbest": 5})
+        self.assertEqual([(hyp.grapheme, hyp.phonemes) for hyp in hyps], [("伊", "i1")])
+        self.assertEqual(self.http_server.requests, [{"source": "伊"}])
+        # the sync clients' connection pools aren't built for nothing
+        self.assertFalse(hasattr(moses, "_pool"))
+        self.assertFalse(hasattr(allennlp, "http_session"))
@@ -0,0 +1,33 @@
+import unittest
+
+from tsm.dict_segmenter import DictSegmenter
+from tsm.util import dict_seg
+
+
+class TestDictSegmenter(unittest.TestCase):
+    def setUp(self):
+        self.words = {"a", "b", "ab", "ba", "aba"}
+
+    def test_ties_follow_tie_break(self):
+        backward = DictSegmenter(self.words)
+        forward = DictSegmenter(self.words, tie_break="forward")
+        self.assertEqual(list(backward.segmentations("ababa")), [["ab", "aba"], ["aba", "ba"]])
+        self.assertEqual(list(forward.segmentations("ababa")), [["aba", "ba"], ["ab", "aba"]])
+        self.assertEqual(backward.segment("ababa"), ["ab", "aba"])
+        self.assertEqual(dict_seg("ababa", self.words), [["ab", "aba"], ["aba", "ba"]])
+
+    def test_lattice_holds_every_best_segmentation(self):
+        self.assertEqual(DictSegmenter(self.words).lattice("ababa"), [[2, 3], [], [5], [5], []])
+        self.assertEqual(DictSegmenter(self.words).lattice("xab"), [[1], [3], []])
+
+    def test_kbest_and_unknown_characters(self):
+        segmenter = DictSegmenter(self.words, tie_break="forward")
+        self.assertEqual(segmenter.kbest("ababa", 3), [["aba", "ba"], ["ab", "aba"], ["ab", "ab", "a"]])
+        self.assertEqual(segmenter.segment("xaby"), ["x", "ab", "y"])
+        self.assertEqual(segmenter.segment(""), [])
+
+    def test_max_word_len(self):
+        self.assertEqual(DictSegmenter(self.words, max_word_len=2).segment("aba"), ["a", "ba"])
+
+    def test_long_input(self):
+        self.assertEqual(DictSegmenter({"a", "aa"}).segment("a" * 10001), ["a"] + ["aa"] * 5000)
@@ -2,6 +2,9 @@ from itertools import accumulate
 import unittest
 from typing import List, Dict, Any
 import logging
+import time
+import asyncio
+from unittest import mock
 
 import re
 import nltk
@@ -10,10 +13,11 @@ import json
 
 from tsm.chinese_head_finder import ChineseSemanticHeadFinder as ChineseHeadFinder
 from tsm.sentence import Sentence
-from tsm.g2p import ToneSandhiG2P
+from tsm.g2p import ToneSandhiG2P, AsyncToneSandhiG2P, SandhiDecision
 from tsm.util import alignment_to_tgt2src
 from tsm.util import cut_source_tokens_from_target_tokens_and_obtain_sandhi_boundaries
 from tsm.test_case import TSMTestCase
+from tsm.cache import LRUCache
 import editdistance
 
 logger = logging.getLogger(__name__)
@@ -56,6 +60,57 @@ class TestG2P(unittest.TestCase):
         boundaries = g2p.infer_sandhi_boundary(tree, phrase_is_lexically_governed)  
         self.assertEqual(boundaries, [False, True, False, False, True])
 
+    def test_trace_records_sandhi_decisions(self):
+        g2p = ToneSandhiG2P(base_g2p=None, parser_url="", head_finder=ChineseHeadFinder())
+        tree = Tree.fromstring("(ROOT (IP (NP (PN 伊)) (VP (VC 是) (NP (NN 囡仔)))))")
+        trace = []
+        governed = g2p.lexical_government(tree, trace)
+        boundaries = g2p.infer_sandhi_boundary(tree, governed, trace)
+        self.assertEqual(boundaries, g2p.infer_sandhi_boundary(tree, g2p.lexical_government(tree)))
+        self.assertIn(SandhiDecision("government", (0, 1, 1), "囡仔", head="是"), trace)
+        self.assertIn(SandhiDecision("boundary", (0,), "伊 是 囡仔", reason="sandhi domain"), trace)
+        self.assertEqual(len([d for d in trace if d.stage == "government"]), len(governed))
+
+    def test_batch_keeps_input_order(self):
+        class EchoG2P(ToneSandhiG2P):
+            def fetch(self, sent):
+                time.sleep(0.01 * (len(sent) % 3))
+                return sent, None, None
+
+            def analyze(self, chars, obj, phns):
+                return chars
+
+        g2p = EchoG2P(base_g2p=None, parser_url="", head_finder=ChineseHeadFinder())
+        sents = [str(idx) * (idx % 5 + 1) for idx in range(20)]
+        self.assertEqual(list(g2p.batch(sents, max_in_flight=4)), sents)
+        self.assertEqual(list(g2p.batch(sents, max_in_flight=1)), sents)
+
+    def test_async_batch_keeps_input_order(self):
+        class EchoG2P(AsyncToneSandhiG2P):
+            async def fetch(self, sent):
+                await asyncio.sleep(0.01 * (len(sent) % 3))
+                return sent, None, None
+
+            def analyze(self, chars, obj, phns):
+                return chars
+
+        g2p = EchoG2P(base_g2p=None, parser_url="", head_finder=ChineseHeadFinder())
+        sents = [str(idx) * (idx % 5 + 1) for idx in range(20)]
+        self.assertEqual(asyncio.run(g2p.abatch(sents)), sents)
+
+    def test_fetch_skips_network_on_cache_hit(self):
+        base_g2p = mock.Mock()
+        base_g2p.translate.return_value = "i1 si7"
+        g2p = ToneSandhiG2P(base_g2p=base_g2p, parser_url="", head_finder=ChineseHeadFinder(), cache=LRUCache())
+        with mock.patch("tsm.g2p.requests.post") as post:
+            post.return_value.json.return_value = {"tree": "(IP (PN 他) (VC 是))", "alignment": [[0, 0], [1, 1]], "source": "伊 是"}
+            first = g2p.fetch("伊是")
+            second = g2p.fetch(" 伊是 ")
+        self.assertEqual(first, second)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(base_g2p.translate.call_count, 1)
+        self.assertEqual(g2p.cache.stats.hits, 1)
+
     def test_get_character_level_sandhi_start_and_ends_from_tree(self):
         sandhi_test_json = TSMTestCase.FIXTURES_ROOT / "sandhi.json"
         with open(sandhi_test_json, "r") as f:
@@ -0,0 +1,24 @@
+import unittest
+
+from nltk.tree import Tree
+
+from tsm.chinese_head_finder import ChineseSemanticHeadFinder
+from tsm.head_finder import CompiledRule
+
+
+class TestHeadFinder(unittest.TestCase):
+    def test_compiled_rule(self):
+        rule = CompiledRule.compile(["left", "VP", "VV"])
+        self.assertEqual(rule.find(["NP", "VV", "VP", "VP"]), 2)
+        self.assertEqual(rule.find(["NP", "PU"]), -1)
+        self.assertEqual(CompiledRule.compile(["rightdis", "NN", "NR"]).find(["NR", "NN", "PU"]), 1)
+        self.assertEqual(CompiledRule.compile(["leftexcept", "PU"]).find(["PU", "NP", "VP"]), 1)
+
+    def test_memoized_heads(self):
+        head_finder = ChineseSemanticHeadFinder()
+        tree = Tree.fromstring("(IP (NP (PN 伊)) (VP (VC 是) (NP (NN 囡仔))) (PU 。))")
+        self.assertIs(head_finder.determine_head(tree, None), tree[1])
+        self.assertEqual(head_finder.head_memo, {("IP", ("NP", "VP", "PU")): 1})
+        other = Tree.fromstring("(IP (NP (NN 我)) (VP (VV 食)) (PU 。))")
+        self.assertIs(head_finder.determine_head(other, None), other[1])
+        self.assertEqual(len(head_finder.head_memo), 1)
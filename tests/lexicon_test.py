@@ -0,0 +1,205 @@
+import unittest
+import tempfile
+import os
+import gzip
+import pickle
+
+import numpy as np
+
+from tsm.lexicon import Lexicon, LexiconEntry, CompactLexicon
+from tsm.symbols import Stratum
+
+
+class TestLexicon(unittest.TestCase):
+    def test_lexicon_entry_is_immutable_and_interned(self):
+        entry = LexiconEntry("".join(["囡", "仔"]), 0.0, " ".join(["gin2", "a2"]), Stratum.白)
+        other = LexiconEntry("囡仔", -1.0, "gin2 a2")
+        self.assertIs(entry.grapheme, other.grapheme)
+        self.assertIs(entry.phonemes, other.phonemes)
+        self.assertEqual(entry.stratum, Stratum.白)
+        self.assertEqual(entry.stratum_code, 2)
+        with self.assertRaises(AttributeError):
+            entry.prob = -1.0
+        self.assertEqual(pickle.loads(pickle.dumps(entry)), entry)
+
+    def test_normalize_prob_of_prons_does_not_mutate(self):
+        prons = [LexiconEntry("伊", np.log(0.5), "i1"), LexiconEntry("伊", np.log(0.25), "i7")]
+        normalized = Lexicon.normalize_prob_of_prons(prons)
+        self.assertAlmostEqual(normalized[0].prob, 0.0)
+        self.assertAlmostEqual(normalized[1].prob, np.log(0.5))
+        self.assertAlmostEqual(prons[0].prob, np.log(0.5))
+
+    def test_merge_duplicated_prons(self):
+        lexicon = Lexicon([LexiconEntry("伊", np.log(0.25), "i1", Stratum.文),
+                           LexiconEntry("伊", np.log(0.25), "i1"),
+                           LexiconEntry("伊", np.log(0.25), "i7", Stratum.文),
+                           LexiconEntry("伊", np.log(0.25), "i7", Stratum.白)])
+        entries = sorted(lexicon["伊"], key=lambda e: e.phonemes)
+        self.assertEqual([(e.phonemes, e.stratum) for e in entries], [("i1", Stratum.文), ("i7", Stratum.無)])
+        self.assertEqual([round(e.prob, 6) for e in entries], [0.0, 0.0])
+        self.assertEqual(lexicon.get_most_probable("伊").grapheme, "伊")
+        self.assertEqual(lexicon.get_oovs(["伊", "我"]), ["我"])
+
+    def test_merge_entries_matches_merge_duplicated_prons(self):
+        entries = [LexiconEntry("伊", np.log(0.1), "i1"), LexiconEntry("我", np.log(0.3), "gua2", Stratum.白),
+                   LexiconEntry("伊", np.log(0.2), "i1 ", Stratum.文), LexiconEntry("伊", -np.inf, "i7"),
+                   LexiconEntry("你", np.log(0.4), "li2"), LexiconEntry("伊", np.log(0.3), "i7")]
+        for sum_dup_pron_probs in [True, False]:
+            merged = Lexicon.merge_entries(entries, sum_dup_pron_probs)
+            self.assertEqual(list(merged), ["伊", "我", "你"])
+            for grapheme, prons in merged.items():
+                expected = Lexicon.merge_duplicated_prons([e for e in entries if e.grapheme == grapheme],
+                                                          sum_dup_pron_probs)
+                self.assertEqual([(e.phonemes, e.stratum) for e in prons], [(e.phonemes, e.stratum) for e in expected])
+                np.testing.assert_allclose([e.prob for e in prons], [e.prob for e in expected])
+
+    def test_add_and_remove_entries(self):
+        entries = [LexiconEntry("伊", np.log(0.5), "i1"), LexiconEntry("伊", np.log(0.25), "i7"),
+                   LexiconEntry("我", 0.0, "gua2")]
+        lexicon = Lexicon(entries[:2])
+        untouched = lexicon["伊"]
+        touched = lexicon.add_entries(iter([entries[2]]))
+        self.assertEqual(touched, ["我"])
+        self.assertIs(lexicon["伊"], untouched)
+        self.assertEqual(lexicon["我"], [entries[2]])
+
+        lexicon.add_entries([LexiconEntry("伊", np.log(0.5), "i7")])
+        self.assertEqual({e.phonemes: round(e.prob, 6) for e in lexicon["伊"]}, {"i1": 0.0, "i7": 0.0})
+
+        touched = lexicon.remove_entries([("伊", "i7"), ("伊", "i5"), "我", "你"])
+        self.assertEqual(touched, ["伊", "我"])
+        self.assertNotIn("我", lexicon)
+        self.assertEqual([(e.phonemes, e.prob) for e in lexicon["伊"]], [("i1", 0.0)])
+
+    def test_dict_mutators_keep_rankings_and_trie_up_to_date(self):
+        lexicon = Lexicon([LexiconEntry("伊", 0.0, "i1"), LexiconEntry("囡仔", 0.0, "gin2 a2")])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 1)], ["i1"])
+        self.assertEqual(lexicon.trie.longest_prefix("囡仔兄"), "囡仔")
+
+        lexicon.update({"伊": [LexiconEntry("伊", 0.0, "i7")]}, 囡仔兄=[LexiconEntry("囡仔兄", 0.0, "gin2 a2 hiann1")])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 1)], ["i7"])
+        self.assertEqual(lexicon.trie.longest_prefix("囡仔兄"), "囡仔兄")
+
+        self.assertEqual([e.phonemes for e in lexicon.pop("囡仔兄")], ["gin2 a2 hiann1"])
+        self.assertIsNone(lexicon.pop("囡仔兄", None))
+        self.assertEqual(lexicon.trie.longest_prefix("囡仔兄"), "囡仔")
+        with self.assertRaises(KeyError):
+            lexicon.get_nbest("囡仔兄", 1)
+
+        lexicon["伊"].append(LexiconEntry("伊", np.log(2.0), "i1"))
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 1)], ["i1"])
+
+        lexicon.setdefault("我", [LexiconEntry("我", 0.0, "gua2")])
+        grapheme, _ = lexicon.popitem()
+        self.assertEqual(grapheme, "我")
+        self.assertIsNone(lexicon.trie.longest_prefix("我"))
+        lexicon.clear()
+        self.assertIsNone(lexicon.trie.longest_prefix("囡仔兄"))
+        with self.assertRaises(KeyError):
+            lexicon.get_nbest("伊", 1)
+
+    def test_get_nbest_uses_ranked_pronunciations(self):
+        lexicon = Lexicon([LexiconEntry("伊", np.log(0.2), "i1", Stratum.文),
+                           LexiconEntry("伊", np.log(0.5), "i7", Stratum.白),
+                           LexiconEntry("伊", np.log(0.5), "i7 a2"),
+                           LexiconEntry("伊", np.log(0.3), "i5", Stratum.白)])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 3)], ["i7", "i7 a2", "i5"])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 3, strata=[Stratum.白])], ["i7", "i5"])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 3, strata=[Stratum.文, Stratum.無])],
+                         ["i7 a2", "i1"])
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 1, lambda e: e.stratum == Stratum.白)], ["i7"])
+        self.assertEqual(lexicon.get_most_probable("伊").phonemes, "i7")
+        with self.assertRaises(KeyError):
+            lexicon.get_nbest("我", 1)
+
+        lexicon.add_entries([LexiconEntry("伊", 0.0, "i1")])
+        self.assertEqual(lexicon.get_most_probable("伊").phonemes, "i1")
+        self.assertEqual([e.phonemes for e in lexicon.get_nbest("伊", 1, strata=[Stratum.白])], ["i7"])
+
+    def test_compact_lexicon_matches_lexicon(self):
+        lexicon = Lexicon([LexiconEntry("伊", np.log(0.5), "i1", Stratum.文),
+                           LexiconEntry("伊", np.log(0.5), "i7", Stratum.白),
+                           LexiconEntry("伊", np.log(0.2), "i1 i1"),
+                           LexiconEntry("囡仔", 0.0, "gin2 a2"),
+                           LexiconEntry("囡仔", 0.0, "gin2-a2")])
+        compact = CompactLexicon.from_lexicon(lexicon)
+        self.assertEqual(sorted(lexicon), list(compact))
+        self.assertIn("伊", compact)
+        self.assertNotIn("我", compact)
+        self.assertEqual(compact.get_oovs(["伊", "我"]), ["我"])
+        for word in lexicon:
+            self.assertEqual(compact[word], lexicon[word])
+            self.assertEqual(compact.get_most_probable(word), lexicon.get_most_probable(word))
+            for n_best in [1, 2, 5]:
+                self.assertEqual(compact.get_nbest(word, n_best), lexicon.get_nbest(word, n_best))
+        is_colloquial = lambda e: e.stratum == Stratum.白
+        self.assertEqual(compact.get_nbest("伊", 5, is_colloquial), lexicon.get_nbest("伊", 5, is_colloquial))
+        self.assertEqual(compact.get_nbest("伊", 5, strata=[Stratum.文, Stratum.無]),
+                         lexicon.get_nbest("伊", 5, strata=[Stratum.文, Stratum.無]))
+        with self.assertRaises(KeyError):
+            compact.get_nbest("我", 1)
+
+    def test_compile_and_open_mmap(self):
+        lexicon = Lexicon([LexiconEntry("伊", np.log(0.5), "i1", Stratum.文),
+                           LexiconEntry("伊", np.log(0.25), "i7", Stratum.白),
+                           LexiconEntry("囡仔", 0.0, "gin2 a2")])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "lexicon.bin")
+            lexicon.compile(path)
+            compact = Lexicon.open_mmap(path)
+            self.assertEqual(list(compact), sorted(lexicon))
+            for word in lexicon:
+                self.assertEqual(compact[word], lexicon[word])
+                self.assertEqual(compact.get_nbest(word, 2), lexicon.get_nbest(word, 2))
+            self.assertFalse(compact.probs.flags.writeable)
+
+    def test_from_moses_streams_compressed_phrase_table(self):
+        lines = [
+            "\\u4f0a ||| \\u4f0a\\uff5ci1 ||| 0.5 1 1 1 ||| 0-0 |||",
+            "\\u4f0a ||| \\u4f0a\\uff5ci1 ||| 0.25 1 1 1 ||| 0-0 |||",
+            "\\u4f0a ||| \\u4f0a\\uff5ci7 ||| 0.25 1 1 1 ||| 0-0 |||",
+            "\\u4f0a \\u662f ||| \\u4f0a\\uff5ci1 \\u662f\\uff5csi7 ||| 0.5 1 1 1 ||| 0-0 |||",
+            "\\u662f ||| NULL ||| 0.5 1 1 1 ||| 0-0 |||",
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "phrase-table.gz")
+            with gzip.open(path, 'wt') as fp:
+                fp.write("\n".join(lines) + "\n")
+            lexicon = Lexicon.from_moses(path)
+        self.assertEqual(list(lexicon), ["伊"])
+        self.assertEqual([(e.phonemes, round(float(np.exp(e.prob)), 6)) for e in lexicon["伊"]],
+                         [("i1", 1.0), ("i7", round(0.25 / 0.75, 6))])
+
+    def test_from_moses_in_parallel_matches_serial(self):
+        lines = [f"\\u4f0a ||| \\u4f0a\\uff5ci{tone} ||| 0.{tone} 1 1 1 ||| 0-0 |||" for tone in range(1, 9)]
+        lines += [f"\\u662f ||| \\u662f\\uff5csi{tone} ||| 0.{tone} 1 1 1 ||| 0-0 |||" for tone in range(1, 9)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "phrase-table")
+            with open(path, 'w') as fp:
+                fp.write("\n".join(lines * 3) + "\n")
+            serial = Lexicon.from_moses(path)
+            parallel = Lexicon.from_moses(path, num_workers=3)
+        self.assertEqual(list(serial), list(parallel))
+        for word in serial:
+            self.assertEqual([e.phonemes for e in serial[word]], [e.phonemes for e in parallel[word]])
+            np.testing.assert_allclose([e.prob for e in serial[word]], [e.prob for e in parallel[word]])
+
+    def test_chunked_dictionary_loading_in_parallel_matches_serial(self):
+        rows = [("伊", "i1", "2"), ("伊", "i7", "1"), ("囡仔", "gín-á", "2"), ("食飯", "tsia̍h-pn̄g", "2"),
+                ("是", "sī", "1"), ("誠", "tsiânn/tsiâ", "2"), ("巧", "khiáu", "2"), ("空", "", "2")]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "moedict.csv")
+            with open(path, 'w') as fp:
+                fp.write("詞目,音讀,文白屬性\n")
+                fp.write("".join(f"{graph},{pron},{stratum}\n" for graph, pron, stratum in rows * 3))
+            serial = Lexicon.from_moedict(path)
+            parallel = Lexicon.from_moedict(path, num_workers=3, chunksize=5)
+            serial_entries = Lexicon.from_dictionary_to_entries(path, "詞目", "音讀")
+            parallel_entries = Lexicon.from_dictionary_to_entries(path, "詞目", "音讀", num_workers=3, chunksize=5)
+        self.assertEqual(serial_entries, parallel_entries)
+        self.assertIn(LexiconEntry("食飯", 0.0, "tsiah8 png7"), serial_entries)
+        self.assertEqual(list(serial), list(parallel))
+        for word in serial:
+            self.assertEqual([(e.phonemes, e.stratum) for e in serial[word]], [(e.phonemes, e.stratum) for e in parallel[word]])
+            np.testing.assert_allclose([e.prob for e in serial[word]], [e.prob for e in parallel[word]])
+        self.assertEqual({e.phonemes for e in serial["誠"]}, {"tsiann5", "tsia5"})
@@ -0,0 +1,160 @@
+from http.server import BaseHTTPRequestHandler
+from itertools import count
+import os
+import signal
+import threading
+import unittest
+import urllib.request
+
+from tsm.model_server import MicroBatcher, ModelHTTPServer, WorkerPoolHTTPServer, fork_workers, wait_workers
+
+
+class ModelNameHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.models.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowHandler(ModelNameHandler):
+    """
+    Answers /health at once and other paths once `self.server.gate` is set.
+    """
+    def do_GET(self):
+        if self.path == "/health":
+            body = b"ok"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.server.gate.wait()
+            super().do_GET()
+
+
+class FakeModels:
+    """
+    Upper-cases sentences, failing on "bad", and records the size of every batch it parses.
+    """
+    def __init__(self, batch_sizes):
+        self.batch_sizes = batch_sizes
+
+    def parse(self, src_sent):
+        if src_sent == "bad":
+            raise ValueError(src_sent)
+        return src_sent.upper()
+
+    def parse_batch(self, src_sents):
+        self.batch_sizes.append(len(src_sents))
+        return [self.parse(src_sent) for src_sent in src_sents]
+
+
+class TestWorkerPoolHTTPServer(unittest.TestCase):
+    def test_workers_serve_with_their_own_models(self):
+        def load_models():
+            return threading.current_thread().name
+
+        server = WorkerPoolHTTPServer(("localhost", 0), ModelNameHandler, 2, load_models)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}/"
+        try:
+            names = {urllib.request.urlopen(url).read().decode('utf-8') for _ in range(4)}
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(names <= {worker.name for worker in server._workers})
+        self.assertFalse(any(worker.is_alive() for worker in server._workers))
+
+    def test_health_is_answered_while_workers_are_busy(self):
+        server = WorkerPoolHTTPServer(("localhost", 0), SlowHandler, 1, lambda: "models")
+        server.gate = threading.Event()
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}"
+        results = []
+        slow = threading.Thread(target=lambda: results.append(urllib.request.urlopen(url + "/parse").read()))
+        try:
+            slow.start()
+            self.assertEqual(urllib.request.urlopen(url + "/health", timeout=5).read(), b"ok")
+            self.assertEqual(results, [])
+            server.gate.set()
+            slow.join(5)
+        finally:
+            server.gate.set()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(results, [b"models"])
+
+    def test_failed_model_loading_fails_start(self):
+        loads = count()
+
+        def load_models():
+            if next(loads) == 1:
+                raise RuntimeError("no checkpoint")
+            return "models"
+
+        with self.assertRaisesRegex(RuntimeError, "no checkpoint"):
+            WorkerPoolHTTPServer(("localhost", 0), ModelNameHandler, 3, load_models)
+        self.assertEqual(next(loads), 3)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_callers_get_their_own_results(self):
+        batch_sizes = []
+        batcher = MicroBatcher(lambda: FakeModels(batch_sizes), num_workers=2, max_batch_size=3, max_wait_ms=50.0)
+        sents = ["a", "b", "bad", "c", "d", "e", "f"]
+        futures = [batcher.submit(sent) for sent in sents]
+        self.assertEqual(batcher.parse_batch(["g", "h"]), ["G", "H"])
+        batcher.close()
+
+        for sent, future in zip(sents, futures):
+            if sent == "bad":
+                self.assertIsInstance(future.exception(), ValueError)
+            else:
+                self.assertEqual(future.result(), sent.upper())
+        self.assertEqual(sum(batch_sizes), len(sents) + 2)
+        self.assertLessEqual(max(batch_sizes), 3)
+        self.assertLess(len(batch_sizes), len(sents) + 2)
+        self.assertFalse(any(worker.is_alive() for worker in batcher._workers))
+
+    def test_failed_model_loading_fails_start(self):
+        loads = count()
+
+        def load_models():
+            if next(loads) == 0:
+                raise RuntimeError("no checkpoint")
+            return FakeModels([])
+
+        with self.assertRaisesRegex(RuntimeError, "no checkpoint"):
+            MicroBatcher(load_models, num_workers=2)
+
+
+class TestForkWorkers(unittest.TestCase):
+    def test_workers_serve_until_terminated(self):
+        server = ModelHTTPServer(("localhost", 0), ModelNameHandler)
+        try:
+            pids = fork_workers(server, 2, lambda: f"models of {os.getpid()}")
+        finally:
+            server.socket.close()
+        url = f"http://localhost:{server.server_address[1]}/"
+        names = {urllib.request.urlopen(url, timeout=5).read().decode('utf-8') for _ in range(4)}
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        with self.assertNoLogs(level="ERROR"):
+            wait_workers(pids)
+        self.assertTrue(names <= {f"models of {pid}" for pid in pids})
+
+    def test_failed_model_loading_fails_start(self):
+        def load_models():
+            raise RuntimeError("no checkpoint")
+
+        server = ModelHTTPServer(("localhost", 0), ModelNameHandler)
+        try:
+            with self.assertRaisesRegex(RuntimeError, "2 of 2 workers failed"):
+                fork_workers(server, 2, load_models)
+        finally:
+            server.socket.close()
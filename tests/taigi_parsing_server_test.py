@@ -0,0 +1,80 @@
+import json
+import threading
+import unittest
+import urllib.request
+
+from nltk.tree import Tree
+
+from tsm.model_server import ModelHTTPServer
+from tsm.taigi_parsing_server import TaigiModels, TaigiServer
+
+
+class StubClient:
+    def __init__(self, translations):
+        self.translations = translations
+        self.calls = []
+
+    def translate(self, src_char_sent):
+        self.calls.append(src_char_sent)
+        tgt_char_sent, alignment = self.translations[src_char_sent]
+        return {"text": tgt_char_sent,
+                "word-align": [{"source-word": src, "target-word": tgt} for src, tgt in alignment]}
+
+
+class StubCutter:
+    def __init__(self):
+        self.calls = []
+
+    def tokenize(self, sents):
+        self.calls.append(sents)
+        return [list(sent) for sent in sents]
+
+
+class StubParser:
+    def __init__(self):
+        self.calls = []
+
+    def parse_sents(self, sents):
+        self.calls.append(sents)
+        return [Tree("IP", [Tree("NN", [token]) for token in tokens]) for tokens in sents]
+
+
+class TestTaigiModels(unittest.TestCase):
+    def setUp(self):
+        self.client = StubClient({"伊 食 飽": ("他 吃 飽", [(0, 0), (1, 1), (2, 2)]),
+                                  "囡 仔": ("小 孩", [(0, 1), (1, 0)]),
+                                  "好": ("好", [(0, 0)])})
+        self.cutter = StubCutter()
+        self.parser = StubParser()
+        self.models = TaigiModels(self.client, self.cutter, self.parser)
+
+    def test_parse_batch_keeps_sentences_aligned(self):
+        results = self.models.parse_batch(["伊食飽", "囡仔", "好"])
+        self.assertEqual(self.client.calls, ["伊 食 飽", "囡 仔", "好"])
+        self.assertEqual(self.cutter.calls, [["他吃飽", "小孩", "好"]])
+        self.assertEqual(self.parser.calls, [[["他", "吃", "飽"], ["小", "孩"], ["好"]]])
+        self.assertEqual([result["source"] for result in results], ["伊 食 飽", "囡 仔", "好"])
+        self.assertEqual([result["target"] for result in results], ["他 吃 飽", "小 孩", "好"])
+        self.assertEqual([result["alignment"] for result in results], [[(0, 0), (1, 1), (2, 2)], [(0, 1), (1, 0)], [(0, 0)]])
+        self.assertEqual(results[1]["tree"], str(Tree("IP", [Tree("NN", ["小"]), Tree("NN", ["孩"])])))
+        self.assertEqual(self.models.parse("囡仔"), results[1])
+
+    def test_parse_batch_route(self):
+        server = ModelHTTPServer(("localhost", 0), TaigiServer)
+        server.models = self.models
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}"
+
+        def post(path, data):
+            request = urllib.request.Request(url + path, data=json.dumps(data).encode('utf-8'), method="POST")
+            return json.loads(urllib.request.urlopen(request).read())
+
+        try:
+            batch = post("/parse_batch", {"sentences": ["囡仔", "伊食飽"]})
+            single = post("/parse", {"sentence": "囡仔"})
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([result["target"] for result in batch], ["小 孩", "他 吃 飽"])
+        self.assertEqual(batch[0]["alignment"], [[0, 1], [1, 0]])
+        self.assertEqual(single, batch[0])
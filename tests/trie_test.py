@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from tsm.lexicon import Lexicon, LexiconEntry
+from tsm.trie import Trie
+
+
+class TestTrie(unittest.TestCase):
+    def test_prefix_queries(self):
+        trie = Trie(["囡", "囡仔", "囡仔兄", "仔", "伊"])
+        self.assertEqual(len(trie), 5)
+        self.assertIn("囡仔", trie)
+        self.assertNotIn("囡仔兄弟", trie)
+        self.assertEqual(trie.prefixes("伊是囡仔兄", 2), ["囡", "囡仔", "囡仔兄"])
+        self.assertEqual(trie.prefix_ends("伊是囡仔兄", 2), [3, 4, 5])
+        self.assertEqual(trie.longest_prefix("囡仔兄弟"), "囡仔兄")
+        self.assertIsNone(trie.longest_prefix("伊是", 1))
+        self.assertEqual(list(trie), sorted(["囡", "囡仔", "囡仔兄", "仔", "伊"]))
+        self.assertEqual(list(trie.keys("囡仔")), ["囡仔", "囡仔兄"])
+
+    def test_discard(self):
+        trie = Trie(["囡", "囡仔兄"])
+        trie.discard("囡仔")
+        self.assertEqual(len(trie), 2)
+        trie.discard("囡仔兄")
+        self.assertEqual(list(trie), ["囡"])
+        self.assertEqual(trie.root.children["囡"].children, {})
+
+    def test_lexicon_trie_follows_updates(self):
+        lexicon = Lexicon([LexiconEntry("囡仔", 0.0, "gin2 a2"), LexiconEntry("伊", np.log(0.5), "i1")])
+        self.assertEqual(lexicon.trie.longest_prefix("囡仔兄"), "囡仔")
+        lexicon.add_entries([LexiconEntry("囡仔兄", 0.0, "gin2 a2 hiann1")])
+        lexicon.remove_entries(["伊"])
+        self.assertEqual(lexicon.trie.longest_prefix("囡仔兄"), "囡仔兄")
+        self.assertEqual(list(lexicon.trie), sorted(lexicon))
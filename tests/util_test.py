@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tsm.lexicon import Lexicon, LexiconEntry
+from tsm.util import get_all_possible_translations, kbest_translations, is_canonical_tl, process_pron
+
+
+class TestUtil(unittest.TestCase):
+    def test_kbest_translations(self):
+        lexicon = Lexicon([LexiconEntry("伊", np.log(0.5), "i1"), LexiconEntry("伊", np.log(0.25), "i7"),
+                           LexiconEntry("囡", np.log(0.5), "gin2"), LexiconEntry("囡", np.log(0.1), "kiann2"),
+                           LexiconEntry("伊囡", np.log(0.5), "i1 gin2")])
+        cuts = [["伊", "囡"], ["伊囡"]]
+        everything = get_all_possible_translations(cuts, lexicon)
+        ranked = kbest_translations("伊囡", lexicon, k=10, ends=[[1, 2], [2]])
+        self.assertCountEqual([phonemes for _, phonemes in ranked], everything)
+        self.assertEqual([phonemes for _, phonemes in ranked[:3]], [("i1", "gin2"), ("i1 gin2",), ("i7", "gin2")])
+        self.assertEqual([round(score, 6) for score, _ in ranked[:3]], [0.0] + [round(np.log(0.5), 6)] * 2)
+        self.assertEqual(get_all_possible_translations(cuts, lexicon, k=2), [("i1", "gin2"), ("i1 gin2",)])
+        # by default only the best segmentation, 伊囡, is followed
+        self.assertEqual(kbest_translations("伊囡", lexicon, k=10), [(np.log(0.5), ("i1 gin2",))])
+
+    def test_kbest_translations_of_exponentially_many_segmentations(self):
+        # "abcd" is either ab|cd or abc|d, so "abcd" * 40 has 2 ** 40 best segmentations
+        lexicon = Lexicon([LexiconEntry("ab", np.log(0.5), "ab1"), LexiconEntry("cd", np.log(0.5), "cd1"),
+                           LexiconEntry("abc", np.log(0.9), "abc1"), LexiconEntry("d", np.log(0.9), "d1"),
+                           LexiconEntry("d", np.log(0.1), "d2")])
+        kbest = kbest_translations("abcd" * 40, lexicon, k=3)
+        self.assertEqual(kbest[0][1], ("abc1", "d1") * 40)
+        self.assertEqual(sorted(set(kbest[1][1]) - {"abc1", "d1"}), ["ab1", "cd1"])
+        prob = {e.phonemes: e.prob for entries in lexicon.values() for e in entries}
+        best, switched = prob["abc1"] + prob["d1"], prob["ab1"] + prob["cd1"]
+        np.testing.assert_allclose([score for score, _ in kbest], [40 * best] + [39 * best + switched] * 2)
+
+    def test_process_pron_fast_path_matches_full_conversion(self):
+        canonical = ["gin2 a2", "I1", "tsiah8-png7", "Tshiu2", "ing1", "abc"]
+        converted = ["chiah8", "gîn-á", "Tâi-oân", "oa1", "kheng3", "tsa̍h-bóo", "hnn7", "khùn"]
+        self.assertTrue(all(is_canonical_tl(pron.lower()) for pron in canonical))
+        self.assertFalse(any(is_canonical_tl(pron.lower()) for pron in converted))
+        fast = [process_pron(pron) for pron in canonical + converted]
+        with mock.patch("tsm.util.is_canonical_tl", return_value=False):
+            full = [process_pron(pron) for pron in canonical + converted]
+        self.assertEqual(fast, full)
+        self.assertEqual(fast[:3], ["gin2 a2", "i1", "tsiah8 png7"])
@@ -0,0 +1,181 @@
+from typing import Dict, List, Tuple
+import re
+import threading
+
+from nltk.tree import Tree
+
+TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+
+# phrase and tag labels are interned process-wide, so label ids mean the same in every tree
+LABELS: List[str] = []
+LABEL_IDS: Dict[str, int] = {}
+_labels_lock = threading.Lock()
+
+
+def label_id(label: str) -> int:
+    idx = LABEL_IDS.get(label)
+    if idx is None:
+        with _labels_lock:
+            idx = LABEL_IDS.setdefault(label, len(LABELS))
+            if idx == len(LABELS):
+                LABELS.append(label)
+    return idx
+
+
+class ArrayTree:
+    """
+    A constituency tree stored as flat per-node lists instead of nested `Tree` objects.
+    Nodes, leaves included, are numbered in pre-order from the root at 0, so the children
+    of a node come after it and its descendants are numbered before its next sibling.
+
+    `parent`, `first_child` and `next_sibling` hold node ids, -1 for none; `label_ids` index
+    `LABELS`, -1 for leaves, whose words are in `words`. The leaves under node `i` are
+    `words[leaf_start[i]:leaf_end[i]]`, and `leaf_nodes` maps each leaf back to its node.
+    """
+    def __init__(self):
+        self.parent: List[int] = []
+        self.label_ids: List[int] = []
+        self.first_child: List[int] = []
+        self.next_sibling: List[int] = []
+        self.leaf_start: List[int] = []
+        self.leaf_end: List[int] = []
+        self.words: List[str] = []
+        self.leaf_nodes: List[int] = []
+        self._positions: List[Tuple[int]] = None
+
+    def _add_node(self, mother: int, last_child: List[int], label: str = None, word: str = None) -> int:
+        """
+        Appends a phrase labeled `label`, or a leaf if `word` is given, as the last child of `mother`.
+        """
+        node = len(self.parent)
+        self.parent.append(mother)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.leaf_start.append(len(self.words))
+        if word is not None:
+            self.label_ids.append(-1)
+            self.leaf_nodes.append(node)
+            self.words.append(word)
+            self.leaf_end.append(len(self.words))
+        else:
+            self.label_ids.append(label_id(label))
+            self.leaf_end.append(-1)
+        if mother >= 0:
+            if last_child[mother] < 0:
+                self.first_child[mother] = node
+            else:
+                self.next_sibling[last_child[mother]] = node
+            last_child[mother] = node
+        last_child.append(-1)
+        return node
+
+    @classmethod
+    def fromstring(cls, s: str) -> "ArrayTree":
+        """
+        Reads a bracketed tree such as `(IP (NP (PN 伊)) (VP (VC 是)))`, as `Tree.fromstring` does.
+        """
+        tree = cls()
+        last_child: List[int] = []
+        stack: List[int] = []
+        tokens = TOKEN_RE.findall(s)
+        idx = 0
+        while idx < len(tokens):
+            token = tokens[idx]
+            if token == "(":
+                label = ""
+                if idx + 1 < len(tokens) and tokens[idx + 1] not in ("(", ")"):
+                    label = tokens[idx + 1]
+                    idx += 1
+                if not stack and tree.parent:
+                    raise ValueError(f"more than one tree in {s!r}")
+                stack.append(tree._add_node(stack[-1] if stack else -1, last_child, label))
+            elif token == ")":
+                if not stack:
+                    raise ValueError(f"unbalanced brackets in {s!r}")
+                tree.leaf_end[stack.pop()] = len(tree.words)
+            else:
+                if not stack:
+                    raise ValueError(f"leaf {token!r} outside of a tree in {s!r}")
+                tree._add_node(stack[-1], last_child, word=token)
+            idx += 1
+        if stack or not tree.parent:
+            raise ValueError(f"unbalanced brackets in {s!r}")
+        return tree
+
+    @classmethod
+    def from_tree(cls, root: Tree) -> "ArrayTree":
+        tree = cls()
+        last_child: List[int] = []
+        # (subtree, its mother, whether its leaves are all read)
+        stack = [(root, -1, False)]
+        while stack:
+            subtree, mother, done = stack.pop()
+            if done:
+                tree.leaf_end[mother] = len(tree.words)
+            elif isinstance(subtree, Tree):
+                node = tree._add_node(mother, last_child, subtree.label())
+                stack.append((None, node, True))
+                stack.extend((child, node, False) for child in reversed(subtree))
+            else:
+                tree._add_node(mother, last_child, word=subtree)
+        return tree
+
+    def __len__(self):
+        return len(self.parent)
+
+    def label(self, node: int) -> str:
+        """
+        The label of `node`, or its word if it is a leaf.
+        """
+        label = self.label_ids[node]
+        return self.words[self.leaf_start[node]] if label < 0 else LABELS[label]
+
+    def is_leaf(self, node: int) -> bool:
+        return self.label_ids[node] < 0
+
+    def children(self, node: int) -> List[int]:
+        children = []
+        child = self.first_child[node]
+        while child >= 0:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def is_preterminal(self, node: int) -> bool:
+        child = self.first_child[node]
+        while child >= 0:
+            if self.label_ids[child] >= 0:
+                return False
+            child = self.next_sibling[child]
+        return True
+
+    def leaves(self, node: int = 0) -> List[str]:
+        return self.words[self.leaf_start[node]:self.leaf_end[node]]
+
+    def treepositions(self) -> List[Tuple[int]]:
+        """
+        The `Tree.treeposition` of every node, by node id.
+        """
+        if self._positions is None:
+            positions = [()] * len(self)
+            for node in range(len(self)):
+                child, idx = self.first_child[node], 0
+                while child >= 0:
+                    positions[child] = positions[node] + (idx,)
+                    child, idx = self.next_sibling[child], idx + 1
+            self._positions = positions
+        return self._positions
+
+    def flatten(self, node: int) -> Tree:
+        """
+        `Tree.flatten` of the subtree at `node`.
+        """
+        return Tree(self.label(node), self.leaves(node))
+
+    def to_tree(self, node: int = 0, tree_class=Tree) -> Tree:
+        if self.is_leaf(node):
+            return self.label(node)
+        return tree_class(self.label(node), [self.to_tree(child, tree_class) for child in self.children(node)])
+
+    def pformat(self, **kwargs) -> str:
+        return self.to_tree().pformat(**kwargs)
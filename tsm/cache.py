@@ -0,0 +1,188 @@
+from typing import Any, Callable, Hashable, Iterable, Optional
+from collections import OrderedDict
+from abc import ABCMeta, abstractmethod
+import hashlib
+import pickle
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return f"hits={self.hits} misses={self.misses} hit_rate={self.hit_rate:.3f}"
+
+
+class Cache(metaclass=ABCMeta):
+    """
+    A cache maps hashable keys to values, `get` returns `None` on a miss so `None` can't be cached.
+    """
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: Hashable, is_hit: Callable[[Any], bool] = None) -> Optional[Any]:
+        """
+        The value of `key`, or `None`. If given, `is_hit` tells whether a value found counts
+        as a hit in `stats`, for callers that can only use some of the values they store.
+        """
+        value = self._get(key)
+        self.stats.record(value is not None and (is_hit is None or is_hit(value)))
+        return value
+
+    @abstractmethod
+    def put(self, key: Hashable, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    def _get(self, key: Hashable) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def invalidate(self, keys: Iterable[Hashable]) -> None:
+        """
+        Drops the entries of `keys`, for when what they were computed from has changed.
+        """
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class LRUCache(Cache):
+    """
+    In-memory cache holding the `maxsize` most recently used entries.
+    """
+    def __init__(self, maxsize: int = 10000):
+        super().__init__()
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache(Cache):
+    """
+    On-disk cache in a sqlite database at `path`, which several processes may share.
+    Keys are stored as the sha1 of their `repr` and values are pickled.
+    """
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)")
+
+    @staticmethod
+    def digest(key: Hashable) -> str:
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (self.digest(key),)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?)", (self.digest(key), blob))
+
+    def invalidate(self, keys):
+        digests = [(self.digest(key),) for key in keys]
+        with self._lock:
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", digests)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def close(self):
+        self._conn.close()
+
+
+class TieredCache(Cache):
+    """
+    Looks `tiers` up in order; a hit in a later tier is copied into the earlier ones.
+    Each tier keeps its own stats, `self.stats` counts lookups of the whole cache.
+    """
+    def __init__(self, *tiers: Cache):
+        super().__init__()
+        self.tiers = tiers
+
+    def _get(self, key):
+        for idx, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for upper_tier in self.tiers[:idx]:
+                    upper_tier.put(key, value)
+                return value
+        return None
+
+    def put(self, key, value):
+        for tier in self.tiers:
+            tier.put(key, value)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        for tier in self.tiers:
+            tier.invalidate(keys)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+
+def build_cache(maxsize: int = 10000, path: str = None) -> Cache:
+    """
+    An in-memory LRU cache of `maxsize` entries, backed by a sqlite cache at `path` if given.
+    """
+    memory = LRUCache(maxsize)
+    if path is None:
+        return memory
+    return TieredCache(memory, SqliteCache(path))
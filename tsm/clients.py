@@ -1,16 +1,26 @@
-from typing import List, NamedTuple, Any
+from typing import Iterable, List, NamedTuple, Any
 import numpy as np
 import requests
 import re
+import json
 from itertools import groupby
 from operator import itemgetter
 import logging
+import threading
+import asyncio
+import time
+import queue
+from contextlib import contextmanager
 
+import http.client
 import xmlrpc.client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from tsm.util import char2bpmf
 from tsm.lexicon import Lexicon, LexiconEntry
 from tsm.symbols import Stratum
+from tsm.cache import Cache, build_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +30,76 @@ class MosesConfig(NamedTuple):
     report_all_factors: bool
     n_best: int
 
-class MosesClient:
+
+class PoolConfig(NamedTuple):
+    pool_size: int = 8
+    timeout: float = 30.0
+    max_retries: int = 3
+    backoff_factor: float = 0.1
+
+
+class ClientStats:
+    """
+    Per-client counters. `reconnects` counts every connection opened, including the first one.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.reconnects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, failed: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.failures += failed
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (f"requests={self.requests} failures={self.failures} retries={self.retries} "
+                f"reconnects={self.reconnects} mean_latency={self.mean_latency:.4f}s max_latency={self.max_latency:.4f}s")
+
+
+class KeepAliveTransport(xmlrpc.client.Transport):
+    """
+    `xmlrpc.client.Transport` that applies a socket timeout to its connection and
+    counts how often the connection has to be (re)opened.
+    """
+    def __init__(self, timeout: float, stats: ClientStats):
+        super().__init__()
+        self.timeout = timeout
+        self.stats = stats
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        self.stats.count("reconnects")
+        return connection
+
+
+class BaseMosesClient:
+    """
+    What the Moses clients share: the server url and the request and response formats.
+    """
     def __init__(self,
                  address: str = "localhost",
                  port: int = 8080,
                  path: str = "RPC2",
                  config: MosesConfig = MosesConfig(True, True, 5)):
-        self.server = xmlrpc.client.ServerProxy(f"http://{address}:{port}/{path}")
+        self.url = f"http://{address}:{port}/{path}"
         self.config = config
 
     def format_input(self, sent):
@@ -38,21 +111,6 @@ class MosesClient:
         }
         return data
 
-    def translate(self, sent):
-        formatted_input = self.format_input(sent)
-        return self.server.translate(formatted_input)
-
-    #def translate_cutted(self, sent: List[str]):
-    #    cutted_sent = [b'-'.join([w.encode('unicode-escape') for w in word]) for word in sent]
-    #    raw_sent = b' '.join(cutted_sent).decode('utf-8')
-    #    results = self.translate(raw_sent)
-    #    encoded_nbest = []
-    #    for nbest in results['nbest']:
-    #        nbest['hyp'] = bytearray(nbest['hyp'], encoding='utf-8').decode('unicode_escape')
-    #        encoded_nbest.append(nbest)
-    #    results['nbest'] = encoded_nbest
-    #    return results
-
     @staticmethod
     def parse_hyp(src, hyp):
         raw_text = hyp['hyp'].strip()
@@ -75,12 +133,90 @@ class MosesClient:
         return new_hyps
 
 
-class AllennlpClient:
+class MosesClient(BaseMosesClient):
+    def __init__(self,
+                 address: str = "localhost",
+                 port: int = 8080,
+                 path: str = "RPC2",
+                 config: MosesConfig = MosesConfig(True, True, 5),
+                 pool_config: PoolConfig = PoolConfig()):
+        super().__init__(address, port, path, config)
+        self.pool_config = pool_config
+        self.stats = ClientStats()
+        # a `ServerProxy` holds a single keep-alive connection and can't be shared between
+        # threads, so up to `pool_size` of them are created and handed out one at a time.
+        self._pool = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._num_proxies = 0
+
+    def _new_proxy(self) -> xmlrpc.client.ServerProxy:
+        transport = KeepAliveTransport(self.pool_config.timeout, self.stats)
+        return xmlrpc.client.ServerProxy(self.url, transport=transport)
+
+    @contextmanager
+    def server(self):
+        with self._pool_lock:
+            try:
+                proxy = self._pool.get_nowait()
+            except queue.Empty:
+                proxy = None
+                if self._num_proxies < self.pool_config.pool_size:
+                    self._num_proxies += 1
+                    proxy = self._new_proxy()
+        if proxy is None:
+            proxy = self._pool.get()
+        try:
+            yield proxy
+        finally:
+            self._pool.put(proxy)
+
+    def call(self, method: str, *params):
+        """
+        Calls `method` on the server, retrying with exponential backoff on connection errors.
+        Faults raised by the server itself are not retried.
+        """
+        max_retries, backoff_factor = self.pool_config.max_retries, self.pool_config.backoff_factor
+        for attempt in range(max_retries + 1):
+            start = time.perf_counter()
+            with self.server() as proxy:
+                try:
+                    result = getattr(proxy, method)(*params)
+                    self.stats.record(time.perf_counter() - start)
+                    return result
+                except (OSError, http.client.HTTPException, xmlrpc.client.ProtocolError) as e:
+                    self.stats.record(time.perf_counter() - start, failed=True)
+                    proxy("close")()
+                    if attempt == max_retries:
+                        raise
+                    logger.warning(f"{method} to {self.url} failed ({e}), retrying")
+            self.stats.count("retries")
+            time.sleep(backoff_factor * (2 ** attempt))
+
+    def translate(self, sent):
+        formatted_input = self.format_input(sent)
+        return self.call("translate", formatted_input)
+
+    #def translate_cutted(self, sent: List[str]):
+    #    cutted_sent = [b'-'.join([w.encode('unicode-escape') for w in word]) for word in sent]
+    #    raw_sent = b' '.join(cutted_sent).decode('utf-8')
+    #    results = self.translate(raw_sent)
+    #    encoded_nbest = []
+    #    for nbest in results['nbest']:
+    #        nbest['hyp'] = bytearray(nbest['hyp'], encoding='utf-8').decode('unicode_escape')
+    #        encoded_nbest.append(nbest)
+    #    results['nbest'] = encoded_nbest
+    #    return results
+
+
+class BaseAllennlpClient:
+    """
+    What the AllenNLP clients share: the server url and the request and response formats.
+    """
     def __init__(self,
                  address: str = "localhost",
                  port: int = 8000,
                  path: str = "predict"):
-        self.server = lambda data: requests.post(f"http://{address}:{port}/{path}", json=data)
+        self.url = f"http://{address}:{port}/{path}"
 
     def format_input(self, sent):
         data = {
@@ -88,17 +224,156 @@ class AllennlpClient:
         }
         return data
 
-    def translate(self, sent):
-        formatted_input = self.format_input(sent)
-        prediction = self.server(formatted_input).json()
+    @staticmethod
+    def parse_prediction(sent, prediction):
         log_probs, hypotheses = prediction['class_log_probabilities'], prediction['predicted_tokens']
         entries =  [LexiconEntry("".join(sent), log_prob, " ".join(hypothesis))
                     for log_prob, hypothesis in zip(log_probs, hypotheses)]
         entries = list(filter(lambda e: all([re.match("[a-z]+\d", syl) is not None for syl in e.phonemes.split()]), entries))
         return Lexicon.normalize_prob_of_prons(entries)
 
+
+class AllennlpClient(BaseAllennlpClient):
+    def __init__(self,
+                 address: str = "localhost",
+                 port: int = 8000,
+                 path: str = "predict",
+                 pool_config: PoolConfig = PoolConfig()):
+        super().__init__(address, port, path)
+        self.pool_config = pool_config
+        self.stats = ClientStats()
+        retry = Retry(total=pool_config.max_retries,
+                      backoff_factor=pool_config.backoff_factor,
+                      status_forcelist=[502, 503, 504],
+                      allowed_methods=None)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_config.pool_size,
+                                   max_retries=retry)
+        self.http_session = requests.Session()
+        self.http_session.mount("http://", self.adapter)
+        self.http_session.mount("https://", self.adapter)
+
+    def _num_connections(self) -> int:
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def server(self, data):
+        num_connections = self._num_connections()
+        start = time.perf_counter()
+        try:
+            res = self.http_session.post(self.url, json=data, timeout=self.pool_config.timeout)
+        except requests.RequestException:
+            self.stats.record(time.perf_counter() - start, failed=True)
+            raise
+        finally:
+            self.stats.count("reconnects", self._num_connections() - num_connections)
+        self.stats.record(time.perf_counter() - start)
+        retries = res.raw.retries
+        if retries is not None and retries.history:
+            self.stats.count("retries", len(retries.history))
+        return res
+
+    def translate(self, sent):
+        formatted_input = self.format_input(sent)
+        prediction = self.server(formatted_input).json()
+        return self.parse_prediction(sent, prediction)
+
+
+class AsyncHTTPClient:
+    """
+    Base of the asyncio clients. Requests go through one `aiohttp.ClientSession`,
+    which can be shared between clients so that they share its connection pool,
+    and at most `max_concurrency` requests of a client are outstanding at a time.
+
+    # Parameters
+
+    session : `aiohttp.ClientSession`, optional
+        A session to borrow. If not given, one is created on first use and closed by `close()`.
+    max_concurrency : `int`, optional
+        Maximum number of outstanding requests; also the pool size of an owned session.
+    """
+    def __init__(self, session=None, max_concurrency: int = 16):
+        self._session = session
+        self._owns_session = session is None
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def session(self):
+        if self._session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def post(self, url: str, **kwargs) -> bytes:
+        async with self.semaphore:
+            async with self.session.post(url, **kwargs) as res:
+                res.raise_for_status()
+                return await res.read()
+
+    async def post_json(self, url: str, data: Any) -> Any:
+        return json.loads(await self.post(url, json=data))
+
+    async def close(self) -> None:
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncMosesClient(BaseMosesClient, AsyncHTTPClient):
+    def __init__(self,
+                 address: str = "localhost",
+                 port: int = 8080,
+                 path: str = "RPC2",
+                 config: MosesConfig = MosesConfig(True, True, 5),
+                 session=None,
+                 max_concurrency: int = 16):
+        BaseMosesClient.__init__(self, address, port, path, config)
+        AsyncHTTPClient.__init__(self, session, max_concurrency)
+
+    async def translate(self, sent):
+        formatted_input = self.format_input(sent)
+        payload = xmlrpc.client.dumps((formatted_input,), "translate")
+        body = await self.post(self.url, data=payload.encode('utf-8'),
+                               headers={"Content-Type": "text/xml"})
+        (result,), _ = xmlrpc.client.loads(body)
+        return result
+
+
+class AsyncAllennlpClient(BaseAllennlpClient, AsyncHTTPClient):
+    def __init__(self,
+                 address: str = "localhost",
+                 port: int = 8000,
+                 path: str = "predict",
+                 session=None,
+                 max_concurrency: int = 16):
+        BaseAllennlpClient.__init__(self, address, port, path)
+        AsyncHTTPClient.__init__(self, session, max_concurrency)
+
+    async def translate(self, sent):
+        formatted_input = self.format_input(sent)
+        prediction = await self.post_json(self.url, formatted_input)
+        return self.parse_prediction(sent, prediction)
+
+
 class UnkTranslator:
-    def __init__(self, prob_lexicon, dict_lexicon, taibun_lexicon, consult_order, seq2seq):
+    """
+    Translates unknown words by asking the lexicons and models in `consult_order` in turn.
+    Results of `translate` are memoized in `cache`, by default an in-memory LRU cache of
+    `cache_size` words that is persisted to a sqlite file at `cache_path` if given.
+
+    The memo isn't told about changes to the lexicons: after `add_entries` or `remove_entries`,
+    pass the graphemes they return to `invalidate`, or call `clear` if `taibun_lexicon` changed,
+    since its entries are used for every word it doesn't have.
+    """
+    def __init__(self, prob_lexicon, dict_lexicon, taibun_lexicon, consult_order, seq2seq,
+                 cache: Cache = None, cache_size: int = 10000, cache_path: str = None):
         self.prob_lexicon = prob_lexicon
         self.taibun_lexicon = taibun_lexicon
         self.dict_lexicon = dict_lexicon
@@ -106,7 +381,7 @@ class UnkTranslator:
         self.seq2seq = seq2seq
         self.consultants = [(name, getattr(self, f"{name}_translate")) for name in consult_order]
         self.consult_order = consult_order
-        self.cache = {}
+        self.cache = cache if cache is not None else build_cache(cache_size, cache_path)
 
     def prob_translate(self, word, n_best):
         return self.prob_lexicon.get_nbest(word, n_best)
@@ -116,17 +391,26 @@ class UnkTranslator:
 
     def bpmf_translate(self, word, n_best):
         bpmf = char2bpmf(word)
-        hyps = self.unk_lexicon.get_nbest(bpmf, n_best, lambda e: e.stratum == Stratum.文)
-        hyps += self.unk_lexicon.get_nbest(bpmf, n_best, lambda e: e.stratum == Stratum.白)
-        hyps += self.unk_lexicon.get_nbest(bpmf, n_best, lambda e: e.stratum not in [Stratum.白, Stratum.文])
-        for hyp in hyps:
-            hyp.grapheme = word
-        return hyps
+        hyps = self.unk_lexicon.get_nbest(bpmf, n_best, strata=[Stratum.文])
+        hyps += self.unk_lexicon.get_nbest(bpmf, n_best, strata=[Stratum.白])
+        hyps += self.unk_lexicon.get_nbest(bpmf, n_best, strata=[stratum for stratum in Stratum
+                                                                 if stratum not in [Stratum.白, Stratum.文]])
+        return [LexiconEntry(word, hyp.prob, hyp.phonemes, hyp.stratum) for hyp in hyps]
 
     def seq2seq_translate(self, word, n_best):
         return self.seq2seq.translate(word)
 
+    def invalidate(self, words: Iterable[str]) -> None:
+        self.cache.invalidate(words)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
     def translate(self, word, n_best=1):
+        # keyed on the word alone, so `invalidate` drops its results for every `n_best`
+        cached = self.cache.get(word, is_hit=lambda results: n_best in results)
+        if cached is not None and n_best in cached:
+            return list(cached[n_best])
         translator_name = None
         for name, consultant in self.consultants:
             try:
@@ -135,5 +419,7 @@ class UnkTranslator:
                 break
             except KeyError:
                 continue
-        logger.info(f"Unknown word {word} translated by {translator_name} as {list(map(str, hyps))}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Unknown word %s translated by %s as %s", word, translator_name, list(map(str, hyps)))
+        self.cache.put(word, {**(cached or {}), n_best: tuple(hyps)})
         return hyps
@@ -0,0 +1,146 @@
+from typing import Iterable, Iterator, List, Tuple, Union
+from itertools import islice, takewhile
+import heapq
+
+from tsm.trie import Trie
+
+
+class DictSegmenter:
+    """
+    Segments a string into words of `words`, minimizing first the number of characters
+    not covered by any word, which become single-character words, then the number of words.
+
+    Candidate words are looked up in a trie, so a string of n characters takes O(n * L)
+    lookups, L being the longest word or `max_word_len`. Among cuts of equal cost,
+    `tie_break="backward"` prefers longer words at the end of the string, which is the
+    order `util.dict_seg` used to return them in, and `"forward"` longer words at the start.
+
+    # Parameters
+
+    words : `Union[Trie, Iterable[str]]`
+        A `Trie`, or anything with a `trie` attribute like `Lexicon`, is used as it is;
+        other iterables are indexed into a new `Trie`.
+    max_word_len : `int`, optional
+        Words longer than this are never considered.
+    tie_break : `str`, optional (default = `"backward"`)
+    """
+    def __init__(self, words: Union[Trie, Iterable[str]], max_word_len: int = None, tie_break: str = "backward"):
+        if tie_break not in ("forward", "backward"):
+            raise ValueError(f"tie_break should be 'forward' or 'backward', not {tie_break!r}")
+        if isinstance(words, Trie):
+            self.trie = words
+        else:
+            self.trie = getattr(words, "trie", None) or Trie(words)
+        self.max_word_len = max_word_len
+        self.tie_break = tie_break
+
+    def edges(self, sent: str) -> List[List[Tuple[int, int]]]:
+        """
+        For each start position, the (end, cost) of the words starting there, shortest first.
+        """
+        num_chars = len(sent)
+        unknown_cost = num_chars + 1
+        edges = []
+        for start in range(num_chars):
+            stop = None if self.max_word_len is None else start + self.max_word_len
+            ends = self.trie.prefix_ends(sent, start, stop)
+            word_edges = [(end, 1) for end in ends]
+            if not ends or ends[0] != start + 1:
+                word_edges.insert(0, (start + 1, unknown_cost))
+            edges.append(word_edges)
+        return edges
+
+    def lattice(self, sent: str) -> List[List[int]]:
+        """
+        For each start position, the ends of the words starting there that are part of some
+        best segmentation. Any path through these words is a best segmentation, so this is
+        `segmentations` in O(n * L) space however many of them there are.
+        """
+        num_chars = len(sent)
+        edges = self.edges(sent)
+        # lowest costs from the start of `sent` to every position and from every position to its end
+        reach = [0] + [float("inf")] * num_chars
+        for start, word_edges in enumerate(edges):
+            for end, cost in word_edges:
+                reach[end] = min(reach[end], reach[start] + cost)
+        remaining = [0] * (num_chars + 1)
+        for start in range(num_chars - 1, -1, -1):
+            remaining[start] = min(cost + remaining[end] for end, cost in edges[start])
+        return [[end for end, cost in word_edges if reach[start] + cost + remaining[end] == reach[num_chars]]
+                for start, word_edges in enumerate(edges)]
+
+    def _search(self, sent: str) -> Iterator[Tuple[int, List[int]]]:
+        """
+        Yields (cost, cut positions) of every segmentation of `sent` in order of increasing
+        cost, ties in the order of `tie_break`. A best-first search whose heuristic is the
+        exact cost of the rest of the string, so each segmentation is found without detours.
+        """
+        num_chars = len(sent)
+        edges = self.edges(sent)
+        if self.tie_break == "forward":
+            start, goal = 0, num_chars
+            # longest word first
+            successors = [list(reversed(word_edges)) for word_edges in edges] + [[]]
+        else:
+            start, goal = num_chars, 0
+            successors = [[] for _ in range(num_chars + 1)]
+            for begin, word_edges in enumerate(edges):
+                for end, cost in word_edges:
+                    successors[end].append((begin, cost))
+
+        # exact cost from every position to the goal
+        remaining = [0] * (num_chars + 1)
+        positions = range(num_chars - 1, -1, -1) if start == 0 else range(1, num_chars + 1)
+        for pos in positions:
+            remaining[pos] = min(cost + remaining[nxt] for nxt, cost in successors[pos])
+
+        counter = 0
+        # among ties the most recently pushed path comes first, so paths are finished depth-first
+        heap = [(remaining[start], 0, 0, (start, None))]
+        while heap:
+            estimate, _, cost, path = heapq.heappop(heap)
+            pos = path[0]
+            if pos == goal:
+                cuts = []
+                while path is not None:
+                    cuts.append(path[0])
+                    path = path[1]
+                yield cost, (cuts[::-1] if start == 0 else cuts)
+                continue
+            for nxt, edge_cost in reversed(successors[pos]):
+                counter -= 1
+                heapq.heappush(heap, (cost + edge_cost + remaining[nxt], counter, cost + edge_cost, (nxt, path)))
+
+    @staticmethod
+    def cuts_to_words(sent: str, cuts: List[int]) -> List[str]:
+        return [sent[begin:end] for begin, end in zip(cuts[:-1], cuts[1:])]
+
+    def segment(self, sent: str) -> List[str]:
+        """
+        The best segmentation of `sent`.
+        """
+        if not sent:
+            return []
+        _, cuts = next(self._search(sent))
+        return self.cuts_to_words(sent, cuts)
+
+    def segmentations(self, sent: str) -> Iterator[List[str]]:
+        """
+        Lazily generates every segmentation of `sent` with the lowest cost.
+        """
+        if not sent:
+            yield []
+            return
+        search = self._search(sent)
+        best_cost, cuts = next(search)
+        yield self.cuts_to_words(sent, cuts)
+        for _, cuts in takewhile(lambda result: result[0] == best_cost, search):
+            yield self.cuts_to_words(sent, cuts)
+
+    def kbest(self, sent: str, k: int) -> List[List[str]]:
+        """
+        The `k` segmentations of `sent` with the lowest costs, best first.
+        """
+        if not sent:
+            return [[]]
+        return [self.cuts_to_words(sent, cuts) for _, cuts in islice(self._search(sent), k)]
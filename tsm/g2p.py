@@ -1,4 +1,4 @@
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Tuple, Set, Any, Iterable, Iterator, NamedTuple, Union
 from nltk import tree
 from 臺灣言語工具.解析整理.拆文分析器 import 拆文分析器
 from tsm.tone_sandhi import 台灣話口語講法
@@ -7,40 +7,110 @@ import re
 import requests
 from nltk.tree import Tree, ParentedTree
 import logging
-from collections import defaultdict
+from collections import deque
 from itertools import groupby
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 
-from tsm.util import word_lengths_to_char_start_and_ends, lexify, cumsum, alignment_to_tgt2src
+from tsm.util import word_lengths_to_char_start_and_ends, cumsum, alignment_to_tgt2src
 from tsm.util import cut_source_tokens_from_target_tokens_and_obtain_sandhi_boundaries, sandhi_mark
-from tsm.util import is_preterminal, path_compression
+from tsm.util import is_preterminal
 from tsm.sentence import Sentence
-from tsm.clients import MosesClient
+from tsm.clients import MosesClient, AsyncMosesClient, AsyncHTTPClient
 from tsm.head_finder import HeadFinder
+from tsm.array_tree import ArrayTree
 from tsm.chinese_head_finder import ChineseSemanticHeadFinder
+from tsm.cache import Cache, build_cache
 
 logger = logging.getLogger(__name__)
 
+SANDHI_DOMAIN_LABEL_RE = re.compile(r"[A-Z]+P$")
+
+
+@lru_cache(maxsize=None)
+def is_sandhi_domain_label(label: str) -> bool:
+    return bool(SANDHI_DOMAIN_LABEL_RE.match(label)) or label == 'NR'
+
+
+class SandhiDecision(NamedTuple):
+    """
+    One decision recorded in a trace: `stage` is "government", where `phrase` is governed
+    by `head`, or "boundary", where `reason` tells why `phrase` does or doesn't end a sandhi domain.
+    """
+    stage: str
+    position: Tuple[int]
+    phrase: str
+    head: str = None
+    reason: str = None
+
 
 class ToneSandhiG2P:
-    def __init__(self,  head_finder: HeadFinder, base_g2p: MosesClient = None, parser_url: str = None) -> None:
+    def __init__(self,  head_finder: HeadFinder, base_g2p: MosesClient = None, parser_url: str = None,
+                 cache: Cache = None) -> None:
         self.lexical_category = {'N', 'V', 'A', 'P'}
         self.base_g2p = base_g2p
         self.parser_url = parser_url
         self.head_finder = head_finder
+        self.cache = cache
+
+    @staticmethod
+    def cache_key(sent: str) -> str:
+        return " ".join(sent.split())
 
     def __call__(self, sent: str) -> str:
+        return self.analyze(*self.fetch(sent))
+
+    def fetch(self, sent: str) -> Tuple[List[str], Dict[str, Any], List[str]]:
+        """
+        Network half of `__call__`: sends `sent` to the parser and to the base G2P,
+        unless the responses for the same sentence are in `self.cache`.
+        """
         chars = Sentence.parse_mixed_text(sent)
+        key = self.cache_key(sent)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            obj, phns = cached
+            return chars, obj, phns
         res = requests.post(self.parser_url, json={"sentence": " ".join(chars)})
         obj = res.json()
-        tgt_tree = ParentedTree.fromstring(obj['tree'])
+        phns = self.base_g2p.translate(sent).split()
+        if self.cache is not None:
+            self.cache.put(key, (obj, phns))
+        return chars, obj, phns
+
+    def analyze(self, chars: List[str], obj: Dict[str, Any], phns: List[str],
+                trace: List[SandhiDecision] = None) -> str:
+        """
+        CPU half of `__call__`: infers sandhi domains from the parser response `obj`.
+        The decisions taken are appended to `trace` if given, e.g.
+        `g2p.analyze(*g2p.fetch(sent), trace=decisions)`.
+        """
+        tgt_tree = ArrayTree.fromstring(obj['tree'])
         alignment = obj['alignment']
         tgt_to_src = alignment_to_tgt2src(alignment)
         src_tokens = obj["source"].split()
-        src_word_lengths, src_sandhi_boundaries = self.get_src_sandhi_start_and_ends(tgt_tree, src_tokens, tgt_to_src)
-        phns = self.base_g2p.translate(sent).split()
-        pron_as_phns = self.infer_pron(chars, phns, src_word_lengths, src_sandhi_boundaries)
+        src_word_lengths, src_sandhi_boundaries = self.get_src_sandhi_start_and_ends(tgt_tree, src_tokens, tgt_to_src, trace)
+        _, pron_as_phns = self.infer_pron(chars, phns, src_word_lengths, src_sandhi_boundaries)
         return " ".join(pron_as_phns)
 
+    def batch(self, sents: Iterable[str], max_in_flight: int = 8) -> Iterator[str]:
+        """
+        Same as calling `self` on each of `sents`, but keeps up to `max_in_flight` sentences
+        waiting on the parser and the base G2P while the trees of earlier ones are analyzed.
+        Results are yielded in input order.
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            pending = deque()
+            for sent in sents:
+                pending.append(executor.submit(self.fetch, sent))
+                if len(pending) >= max_in_flight:
+                    yield self.analyze(*pending.popleft().result())
+            while pending:
+                yield self.analyze(*pending.popleft().result())
+
     def run(self, src_text, phn_text, tgt_tree, tgt_to_src):
         src_tokens = Sentence.parse_mixed_text(src_text)
         src_word_lengths, src_sandhi_boundaries = self.get_src_sandhi_start_and_ends(tgt_tree, src_tokens, tgt_to_src)
@@ -48,38 +118,36 @@ class ToneSandhiG2P:
         graphs, phns = self.infer_pron(src_tokens, phns, src_word_lengths, src_sandhi_boundaries)
         return graphs, phns
 
-    def find_boundary_preterminal(self, root, pos, direction="right"):
-        if isinstance(root[pos], Tree):
-            if direction == "right":
-                boundary_pos = pos + (len(root[pos])-1,)
-            elif direction == "left":
-                boundary_pos = pos + (0,)
-            else:
-                raise ValueError("direction must be either 'right' or 'left'")
-            return self.find_boundary_preterminal(root, boundary_pos)
-        else:
-            return pos
-
-    def infer_sandhi_boundary(self, root: ParentedTree, phrase_is_lexically_governed: Set[Tuple[int]]) -> List[bool]:
-
-        boundary_positions = set()
-        treepositions = root.treepositions()
-        for pos in filter(lambda p: isinstance(root[p], Tree), treepositions):
-            right_boundary_pos = self.find_boundary_preterminal(root, pos, "right")
-            if root[right_boundary_pos[:-1]].label() == "PN" and right_boundary_pos != treepositions[-1]:
-                logger.info("pronouns that are not at the end of the sentence don't have its sandhi domain")
+    def infer_sandhi_boundary(self, root: Union[Tree, ArrayTree], phrase_is_lexically_governed: Set[Tuple[int]],
+                              trace: List[SandhiDecision] = None) -> List[bool]:
+        """
+        Whether each leaf ends a sandhi domain, read off the leaf span of every phrase.
+        """
+        array_tree = self.as_array_tree(root)
+        positions = array_tree.treepositions()
+        num_leaves = len(array_tree.words)
+        verbose = logger.isEnabledFor(logging.INFO)
+        boundaries = [False] * num_leaves
+        for node in range(len(array_tree)):
+            if array_tree.is_leaf(node):
                 continue
-            elif root[right_boundary_pos] == "的":
-                logger.info("for now set all occurrences of '的' as non-boundaries")
+            leaf = array_tree.leaf_end[node] - 1
+            if array_tree.label(array_tree.parent[array_tree.leaf_nodes[leaf]]) == "PN" and leaf != num_leaves - 1:
+                reason = "pronouns that are not at the end of the sentence don't have its sandhi domain"
+            elif array_tree.words[leaf] == "的":
+                reason = "for now set all occurrences of '的' as non-boundaries"
+            elif is_sandhi_domain_label(array_tree.label(node)) and positions[node] not in phrase_is_lexically_governed:
+                reason = None
+                boundaries[leaf] = True
+            else:
                 continue
-            elif (re.match(r"[A-Z]+P$", root[pos].label()) or root[pos].label() == 'NR') and not pos in phrase_is_lexically_governed:
-                logger.info(f"{lexify(root[pos])} is a sandhi domain")
-                boundary_positions.add(right_boundary_pos)
-
-        boundaries = []
-        for pos in treepositions:
-            if not isinstance(root[pos], Tree):
-                boundaries.append(pos in boundary_positions)
+            if verbose and reason:
+                logger.info(reason)
+            elif verbose:
+                logger.info("%s is a sandhi domain", array_tree.flatten(node))
+            if trace is not None:
+                trace.append(SandhiDecision("boundary", positions[node], " ".join(array_tree.leaves(node)),
+                                            reason=reason or "sandhi domain"))
 
         return boundaries
 
@@ -89,67 +157,65 @@ class ToneSandhiG2P:
             if isinstance(child, Tree):
                 self.set_governed(root, child.treeposition(), phrase_is_lexically_governed)
 
-    def lexical_government(self, root: Tree) -> Set[Tuple[int]]:
-        "Determine if phrase_a is phrase_b's lexical head"
-        root = ParentedTree.convert(root)
-        phrase_positions = {pos for pos in root.treepositions() if isinstance(root[pos], Tree)}
-        phrase_is_lexically_governed: Set[Tuple[int]] = set()
+    @staticmethod
+    def as_array_tree(root: Union[Tree, ArrayTree]) -> ArrayTree:
+        return ArrayTree.from_tree(root) if isinstance(root, Tree) else root
 
-        head_of_phrases = {}
-        for pos in phrase_positions:
-            if not is_preterminal(root[pos]):
-                head: Tree = self.head_finder.determine_head(root[pos], root[pos].parent())
-                head_of_phrases[pos] = head.treeposition()
-        head_of_phrases = path_compression(head_of_phrases)
-        logger.info("\n".join([f"head of {lexify(root[pos])}: {lexify(root[head_pos])}" for pos, head_pos in head_of_phrases.items()]))
-
-        # first_branching_nodes = {}
-        # for pos, head_pos in head_of_phrases.items():
-        #     if head_pos not in first_branching_nodes and len(root[pos]) > 1:
-        #         first_branching_nodes[head_pos] = pos
-        #     else:
-        #         if len(root[pos]) > 1 and len(pos) > len(first_branching_nodes[head_pos]):
-        #             first_branching_nodes[head_pos] = pos
-
-        phrases_that_heads_head: Dict[Set[Tuple[int]]] = defaultdict(set)
-        for pos, head_pos in head_of_phrases.items():
-            #if root[pos].label().startswith(root[head_pos][0]):
-            phrases_that_heads_head[head_pos].add(pos)
-
-        # for head_pos, first_branching_pos in first_branching_nodes.items():
-        #     is_conjunction_phrase = any([child.label() == "CC" for child in root[first_branching_pos]])
-        #     if root[head_pos].label() not in self.head_finder.nonlexical_tags:
-        #         for child in root[first_branching_pos]:
-        #             child_pos = child.treeposition()
-        #             if isinstance(root[child_pos], Tree) and head_of_phrases.get(child_pos, child_pos) != head_pos and (not is_conjunction_phrase or child.label() == "CONJ"):
-        #                 logger.info(f"{lexify(child)} is governed by {lexify(root[head_pos])}")
-        #                 phrase_is_lexically_governed.add(child.treeposition())
-
-        for head_pos, phrases_pos in phrases_that_heads_head.items():
-            for phrase_pos in phrases_pos:
-                is_conjunction_phrase = any([child.label() == "CC" for child in root[phrase_pos]])
-                if root[head_pos].label() not in self.head_finder.nonlexical_tags:
-                    for child in root[phrase_pos]:
-                        child_pos = child.treeposition()
-                        if root[head_pos].label()[0] == 'V' and root[child_pos].label() == "LCP":
-                            continue
-                        if root[head_pos].label()[0] == 'V' and root[child_pos].label() == "NP" and child_pos < head_pos:
-                            continue
-                        if isinstance(root[child_pos], Tree) and head_of_phrases.get(child_pos, child_pos) != head_pos and (not is_conjunction_phrase or child.label() == "CONJ"):
-                            logger.info(f"{lexify(child)} is governed by {lexify(root[head_pos])}")
-                            phrase_is_lexically_governed.add(child.treeposition())
+    def lexical_government(self, root: Union[Tree, ArrayTree], trace: List[SandhiDecision] = None) -> Set[Tuple[int]]:
+        """
+        Determine if phrase_a is phrase_b's lexical head.
+
+        Node ids of an `ArrayTree` are in pre-order, so visiting them in reverse finds the
+        lexical head of each phrase, the preterminal its heads lead down to, before its mother's.
+        A child of a phrase is governed if its lexical head differs from the phrase's.
+        """
+        array_tree = self.as_array_tree(root)
+        verbose = logger.isEnabledFor(logging.INFO)
+        lexical_heads = list(range(len(array_tree)))
+        for node in reversed(range(len(array_tree))):
+            if not array_tree.is_leaf(node) and not is_preterminal(array_tree, node):
+                lexical_heads[node] = lexical_heads[self.head_finder.determine_array_head(array_tree, node)]
+                if verbose:
+                    logger.info("head of %s: %s", array_tree.flatten(node), array_tree.flatten(lexical_heads[node]))
+
+        positions = array_tree.treepositions()
+        phrase_is_lexically_governed: Set[Tuple[int]] = set()
+        for node, head in enumerate(lexical_heads):
+            if head == node or array_tree.label(head) in self.head_finder.nonlexical_tags:
+                continue
+            head_label = array_tree.label(head)
+            head_is_verb = head_label[0] == 'V'
+            children = [child for child in array_tree.children(node) if not array_tree.is_leaf(child)]
+            child_labels = [array_tree.label(child) for child in children]
+            is_conjunction_phrase = "CC" in child_labels
+            for child, child_label in zip(children, child_labels):
+                if head_is_verb and child_label == "LCP":
+                    continue
+                # pre-order ids compare like tree positions
+                if head_is_verb and child_label == "NP" and child < head:
+                    continue
+                if lexical_heads[child] != head and (not is_conjunction_phrase or child_label == "CONJ"):
+                    if verbose:
+                        logger.info("%s is governed by %s", array_tree.flatten(child), array_tree.flatten(head))
+                    if trace is not None:
+                        trace.append(SandhiDecision("government", positions[child], " ".join(array_tree.leaves(child)),
+                                                    head=" ".join(array_tree.leaves(head))))
+                    phrase_is_lexically_governed.add(positions[child])
 
         return phrase_is_lexically_governed
 
     def get_src_sandhi_start_and_ends(
         self,
-        tgt_tree: ParentedTree,
+        tgt_tree: Union[Tree, ArrayTree],
         src_tokens: List[str],
         tgt_to_src: Dict[int, List[int]],
+        trace: List[SandhiDecision] = None,
     ) -> Tuple[List[int], List[bool]]:
-        logger.info(tgt_tree.pformat())
-        phrase_is_lexically_governed = self.lexical_government(tgt_tree)
-        tgt_sandhi_boundaries = self.infer_sandhi_boundary(tgt_tree, phrase_is_lexically_governed)
+        tgt_tree = self.as_array_tree(tgt_tree)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(tgt_tree.pformat())
+        phrase_is_lexically_governed = self.lexical_government(tgt_tree, trace)
+        tgt_sandhi_boundaries = self.infer_sandhi_boundary(tgt_tree, phrase_is_lexically_governed, trace)
         src_word_lengths, src_sandhi_boundaries = \
             cut_source_tokens_from_target_tokens_and_obtain_sandhi_boundaries(len(src_tokens), tgt_tree.leaves(), tgt_to_src, tgt_sandhi_boundaries)
         return src_word_lengths, src_sandhi_boundaries
@@ -158,13 +224,62 @@ class ToneSandhiG2P:
         start_and_ends = word_lengths_to_char_start_and_ends(src_word_lengths)
         words = ["-".join(chars[start:end]) + sandhi_mark(boundary) for (start, end), boundary in zip(start_and_ends, src_sandhi_boundaries)]
         word_phns = ["-".join(phns[start:end]) + sandhi_mark(boundary) for (start, end), boundary in zip(start_and_ends, src_sandhi_boundaries)]
-        logger.info(f"grapheme phoneme pairs sent to singhong system: {' '.join(words)}, {' '.join(word_phns)}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("grapheme phoneme pairs sent to singhong system: %s, %s", " ".join(words), " ".join(word_phns))
         sent = 拆文分析器.建立句物件(" ".join(words), " ".join(word_phns))
         tone_sandhi_sent = 台灣話口語講法(sent, to_phn=False, to_TLPA=True, phn_delimiter="", add_circumfix_for_non_taigi_words=False)
         graph_text = tone_sandhi_sent.看型("-", " ", " ")
         phn_text = tone_sandhi_sent.看音("-", " ", " ")
         return graph_text.split(), phn_text.split()
 
+
+class AsyncToneSandhiG2P(ToneSandhiG2P, AsyncHTTPClient):
+    """
+    asyncio version of `ToneSandhiG2P`. Parser requests go through the session of
+    `base_g2p` unless `session` is given, so both share one connection pool.
+    """
+    def __init__(self,
+                 head_finder: HeadFinder,
+                 base_g2p: AsyncMosesClient = None,
+                 parser_url: str = None,
+                 cache: Cache = None,
+                 session=None,
+                 max_concurrency: int = 16) -> None:
+        ToneSandhiG2P.__init__(self, head_finder, base_g2p, parser_url, cache)
+        AsyncHTTPClient.__init__(self, session, max_concurrency)
+
+    @property
+    def session(self):
+        if self._session is None and isinstance(self.base_g2p, AsyncHTTPClient):
+            return self.base_g2p.session
+        return AsyncHTTPClient.session.fget(self)
+
+    async def __call__(self, sent: str) -> str:
+        return self.analyze(*await self.fetch(sent))
+
+    async def fetch(self, sent: str) -> Tuple[List[str], Dict[str, Any], List[str]]:
+        chars = Sentence.parse_mixed_text(sent)
+        key = self.cache_key(sent)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            obj, phns = cached
+            return chars, obj, phns
+        obj, translation = await asyncio.gather(
+            self.post_json(self.parser_url, {"sentence": " ".join(chars)}),
+            self.base_g2p.translate(sent),
+        )
+        phns = translation.split()
+        if self.cache is not None:
+            self.cache.put(key, (obj, phns))
+        return chars, obj, phns
+
+    async def abatch(self, sents: Iterable[str]) -> List[str]:
+        """
+        Runs all of `sents` concurrently, bounded by `max_concurrency` of the clients,
+        and returns the results in input order. Unlike `batch`, a coroutine returning a list.
+        """
+        return await asyncio.gather(*[self(sent) for sent in sents])
+
 if __name__ == "__main__":
     from tsm.util import read_file_to_lines, write_lines_to_file
     import argparse
@@ -174,13 +289,16 @@ if __name__ == "__main__":
     parser.add_argument('--parser-url', default="http://localhost:8080")
     parser.add_argument('--g2p-url', default="http://localhost:8000")
     parser.add_argument('--seg', action='store_true')
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--cache-size', type=int, default=0, help='number of sentences to cache in memory')
+    parser.add_argument('--cache-path', help='sqlite file to persist cached sentences to')
     args = parser.parse_args()
 
     sents = read_file_to_lines(args.input_path)
     g2p_client = MosesClient(args.g2p_url)
     head_finder = ChineseSemanticHeadFinder()
-    sent_of_phonemes = []
-    fp = open(args.output_path, 'w')
-    g2p = ToneSandhiG2P(head_finder, g2p_client, args.parser_url)
-    for sent in sents:
-        g2p(sent)
+    cache = build_cache(args.cache_size, args.cache_path) if args.cache_size or args.cache_path else None
+    g2p = ToneSandhiG2P(head_finder, g2p_client, args.parser_url, cache)
+    write_lines_to_file(args.output_path, g2p.batch(sents, args.max_in_flight))
+    if cache is not None:
+        logger.info(f"cache: {cache.stats}")
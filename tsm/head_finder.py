@@ -1,5 +1,5 @@
 from ctypes import ArgumentError
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional, Sequence, Tuple
 import logging
 from collections import defaultdict
 from abc import ABCMeta, abstractmethod
@@ -7,6 +7,7 @@ from abc import ABCMeta, abstractmethod
 from nltk import Tree
 
 from tsm.util import get_label
+from tsm.array_tree import ArrayTree
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,16 @@ class HeadFinder(metaclass=ABCMeta):
     def determine_head(self, t: Tree, parent: Tree) -> Tree:
         pass
 
+    def determine_array_head(self, tree: ArrayTree, node: int) -> int:
+        """
+        The id of the head child of `node` in `tree`. Converts the subtree to a `Tree`
+        for `determine_head`; subclasses that can should work on the arrays directly.
+        """
+        subtree = tree.to_tree(node)
+        parent = None if tree.parent[node] < 0 else tree.to_tree(tree.parent[node])
+        head = self.determine_head(subtree, parent)
+        return next(child for child, subtree_child in zip(tree.children(node), subtree) if subtree_child is head)
+
 
 class CopulaHeadFinder:
     @abstractmethod
@@ -36,9 +47,17 @@ class AbstractCollinsHeadFinder(HeadFinder, CopulaHeadFinder):
 
     categories_to_avoid : `List[str]`
         Constituent types to avoid as head.
+    memoize : `bool`, optional (default = `True`)
+        Remember the head index of each (mother label, child labels) configuration.
+        Subclasses whose `post_operation_fix` looks at more than labels should turn it off.
+    max_memo_size : `int`, optional (default = `100000`)
+        Configurations beyond this many are not remembered.
     """
-    def __init__(self, *categories_to_avoid: List[str]):
+    def __init__(self, *categories_to_avoid: List[str], memoize: bool = True, max_memo_size: int = 100000):
         self.non_terminal_info: Dict[str, List[List[str]]] = {}
+        self.memoize = memoize
+        self.max_memo_size = max_memo_size
+        self.compiled_rules: Dict[str, List[CompiledRule]] = None
         self.default_rule = None
         self.default_left_rule: List[str] = [""] * (len(categories_to_avoid) + 1)
         self.default_right_rule: List[str] = [""] * (len(categories_to_avoid) + 1)
@@ -62,59 +81,95 @@ class AbstractCollinsHeadFinder(HeadFinder, CopulaHeadFinder):
         if t is None or not isinstance(t, Tree):
             raise ArgumentError("Can't return head of null or leaf Tree.")
 
-        logger.info("determine_head for " + get_label(t))
+        logger.info("determine_head for %s", t.label())
 
         if len(t) == 1:
-            logger.info("Only one child determines " + get_label(t[0]) + " as head of " + get_label(t))
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Only one child determines %s as head of %s", get_label(t[0]), t.label())
             return t[0]
 
         return self.determine_non_trivial_head(t, parent)
 
+    def determine_array_head(self, tree: ArrayTree, node: int) -> int:
+        if not self.non_terminal_info:
+            raise ValueError("Classes derived from AbstractCollinsHeadFinder must create and fill Dict non_terminal_info.")
+
+        if tree.is_leaf(node):
+            raise ArgumentError("Can't return head of null or leaf Tree.")
+
+        children = tree.children(node)
+        if len(children) == 1:
+            return children[0]
+
+        mother_category: str = tree.label(node)
+        if mother_category.startswith('@'):
+            mother_category = mother_category[1:]
+        head_idx = self.determine_head_index(mother_category, tuple([tree.label(child) for child in children]))
+        return None if head_idx is None else children[head_idx]
+
+    def compile_rules(self) -> None:
+        """
+        Compiles `non_terminal_info` and `default_rule` into `CompiledRule`s and empties the
+        memo. Runs on first use; call it again after changing the rules.
+        """
+        self.compiled_rules: Dict[str, List[CompiledRule]] = {
+            category: [CompiledRule.compile(how) for how in hows]
+            for category, hows in self.non_terminal_info.items()
+        }
+        self.compiled_default_rule = None if self.default_rule is None else CompiledRule.compile(self.default_rule)
+        self.compiled_default_left_rule = CompiledRule.compile(self.default_left_rule)
+        self.compiled_default_right_rule = CompiledRule.compile(self.default_right_rule)
+        self.head_memo: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+
     def determine_non_trivial_head(self, t: Tree, parent: Tree) -> Tree:
-        the_head: Tree = None
         mother_category: str = get_label(t)
         if mother_category.startswith('@'):
             mother_category = mother_category[1:]
 
-        logger.info("Looking for head of " + get_label(t))
+        logger.info("Looking for head of %s", t.label())
+
+        child_categories = tuple([subtree.label() if isinstance(subtree, Tree) else subtree for subtree in t])
+        head_idx = self.determine_head_index(mother_category, child_categories)
+        the_head: Tree = None if head_idx is None else t[head_idx]
 
-        how: List[List[str]] = self.non_terminal_info.get(mother_category)
-        if how is None:
-            logger.info(
-                f"Warning: No rule found for {mother_category} (first char: {mother_category[0]})"
-            )
-            if self.default_rule is not None:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("  Chose %s", 'null node' if the_head is None else get_label(the_head))
+        return the_head
+
+    def determine_head_index(self, mother_category: str, child_categories: Tuple[str, ...]) -> Optional[int]:
+        """
+        The index of the head among children labeled `child_categories` of a `mother_category`
+        phrase, memoized on both if `memoize` is set.
+        """
+        if self.compiled_rules is None:
+            self.compile_rules()
+        key = (mother_category, child_categories)
+        if self.memoize and key in self.head_memo:
+            return self.head_memo[key]
+
+        hows: List[CompiledRule] = self.compiled_rules.get(mother_category)
+        head_idx: Optional[int] = None
+        if hows is None:
+            logger.info("Warning: No rule found for %s (first char: %s)", mother_category, mother_category[0])
+            if self.compiled_default_rule is not None:
                 logger.info("Using default rule")
-                return self.traverse_locate([subtree for subtree in t], self.default_rule, True)
+                head_idx = self.locate(child_categories, self.compiled_default_rule, True)
             else:
                 raise ArgumentError(
-                    f"No head rule defined for {mother_category} using {self.__name__} in {t.pformat()}"
+                    f"No head rule defined for {mother_category} using {type(self).__name__}"
                 )
-        for i in range(len(how)):
-            last_resort: bool = i == len(how) - 1
-            the_head = self.traverse_locate([subtree for subtree in t], how[i], last_resort)
-            if the_head is not None:
+        for i in range(len(hows or [])):
+            last_resort: bool = i == len(hows) - 1
+            head_idx = self.locate(child_categories, hows[i], last_resort)
+            if head_idx is not None:
                 break
 
-        logger.info(f"  Chose {'null node' if the_head is None else get_label(the_head)}")
-        return the_head
+        if self.memoize and len(self.head_memo) < self.max_memo_size:
+            self.head_memo[key] = head_idx
+        return head_idx
 
-    def traverse_locate(self, daughter_trees: List[Tree], how: List[str], last_resort: bool) -> Tree:
-        head_idx: int = 0
-        if how[0] == "left":
-            head_idx = self.find_left_head(daughter_trees, how)
-        elif how[0] == "right":
-            head_idx = self.find_right_head(daughter_trees, how)
-        elif how[0] == "leftexcept":
-            head_idx = self.find_left_except_head(daughter_trees, how)
-        elif how[0] == "rightexcept":
-            head_idx = self.find_right_except_head(daughter_trees, how)
-        elif how[0] == "leftdis":
-            head_idx = self.find_left_dis_head(daughter_trees, how)
-        elif how[0] == "rightdis":
-            head_idx = self.find_right_dis_head(daughter_trees, how)
-        else:
-            raise ArgumentError(f"ERROR: invalid direction type {how[0]} to non_terminal_info map in AbstractCollinsHeadFinder.")
+    def locate(self, child_categories: Sequence[str], rule: "CompiledRule", last_resort: bool) -> Optional[int]:
+        head_idx = rule.find(child_categories)
 
         # what happens if our rule didn't match anything
         if head_idx < 0:
@@ -123,72 +178,57 @@ class AbstractCollinsHeadFinder(HeadFinder, CopulaHeadFinder):
                 # if that doesn't match, we'll return the left or rightmost child (by
                 # setting head_idx).  We want to be careful to ensure that post_operation_fix
                 # runs exactly once.
-                rule: str = None
-                if how[0].startswith("left"):
+                if rule.from_left:
                     head_idx = 0
-                    rule = self.default_left_rule
-                else:
-                    head_idx = len(daughter_trees) - 1
-                    rule = self.default_right_rule
-                child = self.traverse_locate(daughter_trees, rule, False)
-                if child is not None:
-                    return child
+                    default_rule = self.compiled_default_left_rule
                 else:
-                    return daughter_trees[head_idx]
+                    head_idx = len(child_categories) - 1
+                    default_rule = self.compiled_default_right_rule
+                child_idx = self.locate(child_categories, default_rule, False)
+                return head_idx if child_idx is None else child_idx
             else:
                 return None
 
-        head_idx = self.post_operation_fix(head_idx, daughter_trees)
-        return daughter_trees[head_idx]
-
-    def find_left_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        head_idx: int = 0
-        for i in range(1, len(how)):
-            for head_idx in range(len(daughter_trees)):
-                child_category: str = get_label(daughter_trees[head_idx])
-                if how[i] == child_category:
-                    return head_idx
-        return -1
-
-    def find_left_dis_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        for head_idx in range(len(daughter_trees)):
-            child_category = get_label(daughter_trees[head_idx])
-            for i in range(1, len(how)):
-                if how[i] == child_category:
-                    return head_idx
-        return -1
-
-    def find_left_except_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        for head_idx in range(len(daughter_trees)):
-            child_category: str = get_label(daughter_trees[head_idx])
-            if child_category not in how[1:]:
-                return head_idx
-        return -1
-
-    def find_right_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        head_idx: int = 0
-        for i in range(1, len(how)):
-            for head_idx in range(len(daughter_trees)-1, -1, -1):
-                child_category: str = get_label(daughter_trees[head_idx])
-                if how[i] == child_category:
-                    return head_idx
-        return -1
-
-    # from right, but search for any of the categories, not by category in turn
-    def find_right_dis_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        for head_idx in range(len(daughter_trees)-1, -1, -1):
-            child_category = get_label(daughter_trees[head_idx])
-            for i in range(1, len(how)):
-                if how[i] == child_category:
-                    return head_idx
-        return -1
-
-    def find_right_except_head(self, daughter_trees: List[Tree], how: List[str]) -> int:
-        for head_idx in range(len(daughter_trees)-1, -1, -1):
-            child_category: str = get_label(daughter_trees[head_idx])
-            if child_category not in how[1:]:
-                return head_idx
-        return -1
-
-    def post_operation_fix(self, head_idx: int, daughter_trees: List[Tree]) -> int:
+        return self.post_operation_fix(head_idx, child_categories)
+
+    def post_operation_fix(self, head_idx: int, child_categories: Sequence[str]) -> int:
+        return head_idx
+
+
+class CompiledRule(NamedTuple):
+    """
+    A `non_terminal_info` rule such as `["left", "VP", "IP"]`, compiled so that finding
+    its head takes one pass over the children. `kind` is "" for rules trying the categories
+    in turn, "dis" for any of them and "except" for none of them; `categories` maps each
+    category to its priority.
+    """
+    from_left: bool
+    kind: str
+    categories: Dict[str, int]
+
+    @classmethod
+    def compile(cls, how: List[str]) -> "CompiledRule":
+        direction = how[0]
+        for side in ("left", "right"):
+            if direction.startswith(side) and direction[len(side):] in ("", "dis", "except"):
+                categories: Dict[str, int] = {}
+                for category in how[1:]:
+                    categories.setdefault(category, len(categories))
+                return cls(side == "left", direction[len(side):], categories)
+        raise ArgumentError(f"ERROR: invalid direction type {direction} to non_terminal_info map in AbstractCollinsHeadFinder.")
+
+    def find(self, child_categories: Sequence[str]) -> int:
+        indices = range(len(child_categories)) if self.from_left else range(len(child_categories) - 1, -1, -1)
+        if self.kind == "except":
+            return next((idx for idx in indices if child_categories[idx] not in self.categories), -1)
+        if self.kind == "dis":
+            return next((idx for idx in indices if child_categories[idx] in self.categories), -1)
+        # the child of the highest priority category, the first found among children of the same
+        head_idx, head_priority = -1, len(self.categories)
+        for idx in indices:
+            priority = self.categories.get(child_categories[idx], head_priority)
+            if priority < head_priority:
+                head_idx, head_priority = idx, priority
+                if priority == 0:
+                    break
         return head_idx
\ No newline at end of file
@@ -1,7 +1,13 @@
-from typing import NamedTuple, List, Union
-from itertools import groupby, product, chain
+from typing import NamedTuple, List, Union, Dict, Tuple, Iterable
+from itertools import groupby, product, chain, islice
+from collections import defaultdict
 import re
-from functools import reduce
+import sys
+import json
+import mmap
+import os
+from functools import reduce, lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import operator
 
 import pandas as pd
@@ -9,16 +15,42 @@ import numpy as np
 import scipy.special
 
 from tsm.symbols import Stratum
+from tsm.trie import Trie
 from tsm.util import read_file_to_lines, write_lines_to_file, flatten, char2bpmf, group
+from tsm.util import open_maybe_compressed, compression_opener
 from tsm.util import raw_graph_to_all_graphs, raw_pron_to_all_prons, process_pron
 import zhon.hanzi
 
-class LexiconEntry:
-    def __init__(self, grapheme: str, prob: float, phonemes: str, stratum: Stratum = Stratum.無):
-        self.grapheme = grapheme
-        self.prob = prob
-        self.phonemes = phonemes
-        self.stratum = stratum
+STRATA = tuple(Stratum)
+
+
+class _LexiconEntryFields(NamedTuple):
+    grapheme: str
+    prob: float
+    phonemes: str
+    stratum_code: int
+
+
+class LexiconEntry(_LexiconEntryFields):
+    """
+    An immutable (grapheme, log-prob, phonemes, stratum) tuple. Graphemes and phonemes are
+    interned so that entries sharing them share one string, and the stratum is stored as
+    its integer code. Use `_replace` to derive a modified entry.
+    """
+    __slots__ = ()
+
+    def __new__(cls, grapheme: str, prob: float, phonemes: str, stratum: Stratum = Stratum.無):
+        if isinstance(grapheme, str):
+            grapheme = sys.intern(grapheme)
+        if isinstance(phonemes, str):
+            phonemes = sys.intern(phonemes)
+        stratum_code = stratum.value if isinstance(stratum, Stratum) else stratum
+        return super().__new__(cls, grapheme, prob, phonemes, stratum_code)
+
+    @property
+    def stratum(self) -> Stratum:
+        return STRATA[self.stratum_code]
+
     def __str__(self):
         grapheme = "".join(self.grapheme) if isinstance(self.grapheme, list) else self.grapheme
         phonemes = " ".join(self.phonemes) if isinstance(self.phonemes, list) else self.phonemes
@@ -26,6 +58,7 @@ class LexiconEntry:
             return f"{grapheme} {phonemes}"
         else:
             return f"{grapheme} {np.exp(self.prob)} {phonemes}"
+
     def __add__(self, other):
         grapheme = self.grapheme + other.grapheme
         prob = self.prob + other.prob
@@ -33,39 +66,247 @@ class LexiconEntry:
         stratum = self.stratum if self.stratum == other.stratum else Stratum.無
         return LexiconEntry(grapheme, prob, phonemes, stratum)
 
+HANZI_RE = re.compile(f"[{zhon.hanzi.characters}]")
+SYLLABLE_RE = re.compile(r"[A-Za-z]+\d")
+MOSES_DELIMITER = r"\|\|\|"
+
+
+@lru_cache(maxsize=None)
+def compile_delimiter(delimiter: str):
+    return re.compile(delimiter)
+
+
 class MosesHelper:
+    @staticmethod
+    def may_be_entry(raw_line: bytes, delimiter: bytes = b"|||") -> bool:
+        """
+        Cheap check on an undecoded phrase table line that rejects multi-word sources and
+        NULL targets, both of which `parse_line_to_entry` would turn into `None`.
+        """
+        columns = raw_line.split(delimiter, 2)
+        if len(columns) < 3:
+            return False
+        return len(columns[0].split()) <= 1 and columns[1].strip() != b"NULL"
+
     @staticmethod
     def parse_line_to_entry(line, strip_punct=True, row=1, delimiter="\s+"):
-        columns = re.split(delimiter, line)
+        columns = compile_delimiter(delimiter).split(line, 3)
         raw_src, raw_tgt, prob = columns[0].strip(), columns[1].strip(), columns[2]
         if raw_tgt == "NULL":
             return None
         if len(raw_src.split()) > 1:
             return None
-        tgt_words = re.split("\s+", raw_tgt)
-        tgt = " ".join([re.split("\uff5c", word)[row] for word in tgt_words])
+        tgt = " ".join([word.split("\uff5c")[row] for word in raw_tgt.split()])
         if strip_punct:
-            src = "".join([match.group(0) for match in 
-                           re.finditer(f"[{zhon.hanzi.characters}]", raw_src)])
-            tgt = " ".join([match.group(0) for match in 
-                            re.finditer(f"[A-Za-z]+\d", tgt)])
+            src = "".join(HANZI_RE.findall(raw_src))
+            if not src:
+                return None
+            tgt = " ".join(SYLLABLE_RE.findall(tgt))
+        else:
+            src = raw_src
         if not (src and tgt):
             return None
-        prob = reduce(operator.mul, map(float, re.split("\s+", prob.strip())))
+        prob = reduce(operator.mul, map(float, prob.split()))
         return LexiconEntry(src, np.log(prob), tgt)
 
+    @staticmethod
+    def add_prob(merged_probs: Dict[str, Dict[str, float]], grapheme: str, phonemes: str, prob: float,
+                 sum_dup_pron_probs: bool = True) -> None:
+        probs = merged_probs.setdefault(grapheme, {})
+        old_prob = probs.get(phonemes)
+        if old_prob is None:
+            probs[phonemes] = prob
+        elif sum_dup_pron_probs:
+            probs[phonemes] = np.logaddexp(old_prob, prob)
+        else:
+            probs[phonemes] = max(old_prob, prob)
+
+    @staticmethod
+    def read_phrase_table(moses_path: str, sum_dup_pron_probs: bool = True,
+                          start: int = 0, end: int = None) -> Tuple[Dict[str, Dict[str, float]], Dict[str, int]]:
+        """
+        Parses the lines of a phrase table that start within bytes `[start, end)`, or all of
+        it if `end` is None, merging duplicated pronunciations as they are read. Returns the
+        merged log-probs by grapheme and pronunciation, and the number of lines per grapheme.
+        """
+        merged_probs: Dict[str, Dict[str, float]] = {}
+        num_entries: Dict[str, int] = defaultdict(int)
+        if end is None:
+            fp = open_maybe_compressed(moses_path)
+        else:
+            fp = open(moses_path, 'rb')
+            if start > 0:
+                # skip the line that straddles `start`, the previous range parses it
+                fp.seek(start - 1)
+                fp.readline()
+        with fp:
+            position = fp.tell() if end is not None else 0
+            for raw_line in fp:
+                if end is not None:
+                    if position >= end:
+                        break
+                    position += len(raw_line)
+                if not MosesHelper.may_be_entry(raw_line):
+                    continue
+                line = raw_line.decode('unicode_escape').rstrip('\r\n')
+                entry = MosesHelper.parse_line_to_entry(line, delimiter=MOSES_DELIMITER)
+                if entry is None:
+                    continue
+                num_entries[entry.grapheme] += 1
+                MosesHelper.add_prob(merged_probs, entry.grapheme, entry.phonemes, entry.prob, sum_dup_pron_probs)
+        return merged_probs, num_entries
+
+def read_csv_in_chunks(dictionary_path: str, keys: List[str], chunksize: int, **kwargs):
+    """
+    Yields the `keys` columns of a CSV file as lists of row tuples, `chunksize` rows at a time.
+    """
+    reader = pd.read_csv(dictionary_path, usecols=keys, dtype={key: str for key in keys},
+                         chunksize=chunksize, **kwargs)
+    for df in reader:
+        df = df.replace(np.nan, "", regex=True)
+        yield list(zip(*[df[key] for key in keys]))
+
+
+def map_chunks(func, chunks, num_workers: int = 1):
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as executor:
+            return list(executor.map(func, chunks))
+    return list(map(func, chunks))
+
+
+def dictionary_rows_to_pairs(rows: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    return [pair for raw_graph, raw_pron in rows # prons = pronunciations
+            for pair in product(raw_graph_to_all_graphs(raw_graph), raw_pron_to_all_prons(raw_pron))]
+
+
+def moedict_rows_to_triples(rows: List[Tuple[str, str, str]]) -> List[Tuple[str, str, Stratum]]:
+    return [triple for raw_graph, raw_pron, raw_stratum in rows
+            for triple in product(raw_graph_to_all_graphs(raw_graph), raw_pron_to_all_prons(raw_pron),
+                                  [Stratum(int(raw_stratum))])]
+
+
+class RankedPronunciations(NamedTuple):
+    entries: List[LexiconEntry]
+    by_stratum: Dict[Stratum, List[LexiconEntry]]
+    most_probable: LexiconEntry
+
+
 class Lexicon(dict):
     def __init__(self, entries: List[NamedTuple], sum_dup_pron_probs: bool = True):
         self.len_diff_heur = lambda e: abs(len(e.grapheme) - len(re.split("\s+", e.phonemes)))
-        super(Lexicon, self).__init__(group(entries, lambda e: e.grapheme).items())
-        self.merge_all_duplicated_prons(sum_dup_pron_probs)
+        # grapheme -> (its list of pronunciations, the length it had, the ranking of them)
+        self._ranked: Dict[str, Tuple[List[LexiconEntry], int, RankedPronunciations]] = {}
+        self._trie: Trie = None
+        super(Lexicon, self).__init__(self.merge_entries(entries, sum_dup_pron_probs))
+
+    # every mutator goes through `__setitem__` or `_forget`, which keep `_ranked` and `_trie` in sync
+    def __setitem__(self, grapheme, entries):
+        self._ranked.pop(grapheme, None)
+        if self._trie is not None:
+            self._trie.add(grapheme)
+        super().__setitem__(grapheme, entries)
+
+    def _forget(self, grapheme):
+        self._ranked.pop(grapheme, None)
+        if self._trie is not None:
+            self._trie.discard(grapheme)
+
+    def __delitem__(self, grapheme):
+        self._forget(grapheme)
+        super().__delitem__(grapheme)
+
+    def update(self, *args, **kwargs):
+        for grapheme, entries in dict(*args, **kwargs).items():
+            self[grapheme] = entries
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, grapheme, entries=None):
+        if grapheme not in self:
+            self[grapheme] = entries
+        return self[grapheme]
+
+    def pop(self, grapheme, *default):
+        if grapheme in self:
+            self._forget(grapheme)
+        return super().pop(grapheme, *default)
+
+    def popitem(self):
+        grapheme, entries = super().popitem()
+        self._forget(grapheme)
+        return grapheme, entries
+
+    def clear(self):
+        super().clear()
+        self._ranked.clear()
+        self._trie = None
+
+    @property
+    def trie(self) -> Trie:
+        """
+        A trie over the graphemes, built on first use and kept up to date afterwards.
+        """
+        if self._trie is None:
+            self._trie = Trie(self)
+        return self._trie
+
+    @staticmethod
+    def merge_entries(entries: List[LexiconEntry], sum_dup_pron_probs: bool = True) -> Dict[str, List[LexiconEntry]]:
+        """
+        Groups `entries` by grapheme and merges duplicated pronunciations of each, with the same
+        result as `merge_duplicated_prons` on every group but in one vectorized pass: entries are
+        sorted by (grapheme, pronunciation), their probabilities are reduced segment-wise, and
+        normalized by the maximum of their grapheme.
+        """
+        entries = list(entries)
+        if not entries:
+            return {}
+        probs = np.array([entry.prob for entry in entries], dtype=np.float64)
+        stratum_codes = np.array([entry.stratum_code for entry in entries], dtype=np.int64)
+        grapheme_ids, graphemes = pd.factorize(pd.Series([entry.grapheme for entry in entries], dtype=object))
+        pron_ids, prons = pd.factorize(pd.Series([entry.phonemes.strip() for entry in entries], dtype=object))
+        # ids number graphemes and (grapheme, pronunciation) pairs in order of first occurrence,
+        # which is the order `group` keeps them in
+        key_ids, keys = pd.factorize(grapheme_ids.astype(np.int64) * len(prons) + pron_ids)
+        order = np.argsort(key_ids, kind='stable')
+        sorted_key_ids = key_ids[order]
+        sorted_probs = probs[order]
+        starts = np.flatnonzero(np.r_[True, sorted_key_ids[1:] != sorted_key_ids[:-1]])
+        first_of_key = order[starts]
+        grapheme_of_key = grapheme_ids[first_of_key]
+
+        key_probs = np.maximum.reduceat(sorted_probs, starts)
+        if sum_dup_pron_probs:
+            shift = np.where(np.isfinite(key_probs), key_probs, 0.0)
+            with np.errstate(divide='ignore'):
+                key_probs = np.log(np.add.reduceat(np.exp(sorted_probs - shift[sorted_key_ids]), starts)) + shift
+
+        # a pronunciation keeps a stratum only if all its entries that have one agree on it
+        sorted_codes = stratum_codes[order]
+        min_codes = np.minimum.reduceat(np.where(sorted_codes == Stratum.無.value, len(STRATA), sorted_codes), starts)
+        max_codes = np.maximum.reduceat(np.where(sorted_codes == Stratum.無.value, -1, sorted_codes), starts)
+        key_codes = np.where(min_codes == max_codes, min_codes, Stratum.無.value)
+
+        # graphemes with a single entry are left as they are, like `merge_duplicated_prons` does
+        num_entries = np.bincount(grapheme_ids, minlength=len(graphemes))
+        max_probs = np.full(len(graphemes), -np.inf)
+        np.maximum.at(max_probs, grapheme_of_key, key_probs)
+        key_probs = np.where(num_entries[grapheme_of_key] > 1, key_probs - max_probs[grapheme_of_key], key_probs)
+
+        merged: Dict[str, List[LexiconEntry]] = {grapheme: [] for grapheme in graphemes}
+        for grapheme_id, first, prob, code in zip(grapheme_of_key.tolist(), first_of_key.tolist(),
+                                                  key_probs.tolist(), key_codes.tolist()):
+            grapheme = graphemes[grapheme_id]
+            merged[grapheme].append(LexiconEntry(grapheme, prob, entries[first].phonemes, code))
+        return merged
 
     @classmethod
     def build_bpmf_unk_interpolater(cls, lexicon):
         entries = []
         def grapheme_to_bpmf(entry):
-            entry.grapheme = char2bpmf(entry.grapheme)
-            return entry
+            return LexiconEntry(char2bpmf(entry.grapheme), entry.prob, entry.phonemes, entry.stratum)
         for graph in lexicon:
             if len(graph) > 1:
                 continue
@@ -97,11 +338,42 @@ class Lexicon(dict):
             self[grapheme] = Lexicon.merge_duplicated_prons(self[grapheme], sum_dup_pron_probs)
 
     @classmethod
-    def from_moses(cls, moses_path):
-        lines = read_file_to_lines(moses_path, True)
-        entries = filter(lambda x: x, [MosesHelper.parse_line_to_entry(line, delimiter='\|\|\|')
-                                       for line in lines])
-        return cls(list(entries))
+    def from_moses(cls, moses_path, sum_dup_pron_probs: bool = True, num_workers: int = 1):
+        """
+        Streams the phrase table at `moses_path`, which may be gzip, bz2 or xz compressed,
+        merging duplicated pronunciations as they are read, so that memory holds one
+        probability per distinct (grapheme, pronunciation) rather than every line.
+        Uncompressed tables are split into byte ranges parsed by `num_workers` processes.
+        """
+        if num_workers > 1 and compression_opener(moses_path) is None:
+            size = os.path.getsize(moses_path)
+            num_chunks = num_workers * 4
+            bounds = [size * idx // num_chunks for idx in range(num_chunks + 1)]
+            with ProcessPoolExecutor(num_workers) as executor:
+                results = list(executor.map(MosesHelper.read_phrase_table,
+                                            [moses_path] * num_chunks,
+                                            [sum_dup_pron_probs] * num_chunks,
+                                            bounds[:-1], bounds[1:]))
+        else:
+            results = [MosesHelper.read_phrase_table(moses_path, sum_dup_pron_probs)]
+
+        merged_probs, num_entries = results[0]
+        for chunk_probs, chunk_num_entries in results[1:]:
+            for grapheme, probs in chunk_probs.items():
+                num_entries[grapheme] += chunk_num_entries[grapheme]
+                for phonemes, prob in probs.items():
+                    MosesHelper.add_prob(merged_probs, grapheme, phonemes, prob, sum_dup_pron_probs)
+        del results
+
+        lexicon = cls([], sum_dup_pron_probs)
+        for grapheme in list(merged_probs):
+            entries = [LexiconEntry(grapheme, prob, phonemes)
+                       for phonemes, prob in merged_probs.pop(grapheme).items()]
+            # like `merge_duplicated_prons`, which leaves graphemes with a single entry as they are
+            if num_entries[grapheme] > 1:
+                entries = cls.normalize_prob_of_prons(entries)
+            lexicon[grapheme] = entries
+        return lexicon
 
     @classmethod
     def from_kaldi(cls, lexicon_path: str, with_prob: bool = False, sum_dup_pron_probs: bool = True):
@@ -131,74 +403,134 @@ class Lexicon(dict):
         out_lines = ["{} {}".format(e.grapheme, e.phonemes) for e in flatten(self.values())]
         write_lines_to_file(dest_path, out_lines)
 
+    def ranked(self, word) -> RankedPronunciations:
+        """
+        The pronunciations of `word` sorted by (-prob, `len_diff_heur`), overall and per stratum.
+        Sorted once per grapheme and kept until the grapheme is assigned or deleted, or its list
+        changes length; entries of the list shouldn't be replaced in place.
+        """
+        prons = self.get(word)
+        if prons is None:
+            raise KeyError(word)
+        cached = self._ranked.get(word)
+        if cached is not None and cached[0] is prons and cached[1] == len(prons):
+            return cached[2]
+        entries = sorted(prons, key=lambda e: (-e.prob, self.len_diff_heur(e)))
+        ranked = RankedPronunciations(entries, group(entries, lambda e: e.stratum),
+                                      max(prons, key=lambda e: e.prob))
+        self._ranked[word] = (prons, len(prons), ranked)
+        return ranked
+
     def get_most_probable(self, word):
-        if word in self:
-            return max(self[word], key=lambda e: e.prob)
-        else:
-            raise KeyError
+        return self.ranked(word).most_probable
 
-    def get_nbest(self, word, n_best, filter_func=(lambda e: True)):
-        if word in self:
-            return sorted(filter(filter_func, self[word]),
-                          key=lambda e: (-e.prob, self.len_diff_heur(e)))[:n_best]
+    def get_nbest(self, word, n_best, filter_func=None, strata: Iterable[Stratum] = None):
+        """
+        The `n_best` most probable pronunciations of `word` that pass `filter_func`, if given,
+        and belong to one of `strata`, if given.
+        """
+        ranked = self.ranked(word)
+        if strata is None:
+            entries = ranked.entries
         else:
-            raise KeyError
+            strata = set(strata)
+            if len(strata) == 1:
+                entries = ranked.by_stratum.get(next(iter(strata)), [])
+            else:
+                entries = (entry for entry in ranked.entries if entry.stratum in strata)
+        if filter_func is not None:
+            entries = filter(filter_func, entries)
+        return list(islice(entries, n_best))
 
     @staticmethod
     def normalize_prob_of_prons(prons: List[LexiconEntry]):
         if len(prons) == 0:
             return []
-        new_hyps = []
         probs = np.array([pron.prob for pron in prons])
         max_prob = np.max(probs)
-        for pron in prons:
-            pron.prob = pron.prob - max_prob
-        return prons
+        return [pron._replace(prob=pron.prob - max_prob) for pron in prons]
 
     def get_oovs(self, maybe_oov_words: List[str]):
         return list(filter(lambda word: word not in self, maybe_oov_words))
 
-    def add_entries(self, entries: List[LexiconEntry]):
-        for entry in entries:
-            if entry.grapheme in self:
-                self[grapheme].append(entry)
+    def compile(self, path: str) -> None:
+        """
+        Writes the lexicon in the binary format read by `open_mmap`.
+        """
+        CompactLexicon.from_lexicon(self).save(path)
+
+    @staticmethod
+    def open_mmap(path: str) -> "CompactLexicon":
+        """
+        Maps a lexicon written by `compile` read-only into memory, so loading takes no parsing
+        and processes opening the same file share its pages.
+        """
+        return CompactLexicon.open_mmap(path)
+
+    def add_entries(self, entries: Iterable[LexiconEntry], sum_dup_pron_probs: bool = True) -> List[str]:
+        """
+        Merges `entries`, which may be any iterable, into the lexicon. Only the graphemes they
+        touch are re-merged and re-normalized; returns those graphemes.
+        """
+        new_entries = group(entries, lambda e: e.grapheme)
+        for grapheme, prons in new_entries.items():
+            self[grapheme] = self.merge_duplicated_prons(self.get(grapheme, []) + prons, sum_dup_pron_probs)
+        return list(new_entries)
+
+    def remove_entries(self, keys: Iterable[Union[str, Tuple[str, str]]]) -> List[str]:
+        """
+        Removes graphemes, given as strings, or single pronunciations, given as
+        (grapheme, phonemes) pairs. Graphemes left without pronunciations are removed,
+        the others are re-normalized. Returns the touched graphemes.
+        """
+        removed = defaultdict(set)
+        for key in keys:
+            if isinstance(key, str):
+                removed[key] = None
+            elif removed[key[0]] is not None:
+                removed[key[0]].add(key[1].strip())
+        touched = []
+        for grapheme, phonemes in removed.items():
+            if grapheme not in self:
+                continue
+            prons = [] if phonemes is None else [e for e in self[grapheme] if e.phonemes.strip() not in phonemes]
+            if len(prons) == len(self[grapheme]):
+                continue
+            if prons:
+                self[grapheme] = self.normalize_prob_of_prons(prons)
             else:
-                self[grapheme] = [entry]
-        self.merge_all_duplicated_prons()
+                del self[grapheme]
+            touched.append(grapheme)
+        return touched
 
     @staticmethod
-    def from_dictionary_to_entries(dictionary_path, grapheme_key, phoneme_key, raw_entries=False):
-        df = pd.read_csv(dictionary_path, dtype={grapheme_key: str, phoneme_key: str})
-        df = df.replace(np.nan, "", regex=True)
-        all_raw_entries = list(zip(df[grapheme_key], df[phoneme_key]))
+    def from_dictionary_to_entries(dictionary_path, grapheme_key, phoneme_key, raw_entries=False,
+                                   num_workers: int = 1, chunksize: int = 10000):
+        chunks = read_csv_in_chunks(dictionary_path, [grapheme_key, phoneme_key], chunksize)
         if raw_entries:
-            return all_raw_entries
-        all_entries = []
-        for raw_graph, raw_pron in all_raw_entries: # prons = pronunciations
-            entries = list(product(raw_graph_to_all_graphs(raw_graph), raw_pron_to_all_prons(raw_pron)))
-            all_entries.append(entries)
-        return [LexiconEntry(graph, 0.0, pron) for graph, pron in chain(*all_entries)]
+            return list(chain(*chunks))
+        pairs = map_chunks(dictionary_rows_to_pairs, chunks, num_workers)
+        return [LexiconEntry(graph, 0.0, pron) for graph, pron in chain(*pairs)]
 
     @classmethod
-    def from_dictionary(cls, *args):
-        return cls(cls.from_dictionary_to_entries(*args))
+    def from_dictionary(cls, *args, **kwargs):
+        return cls(cls.from_dictionary_to_entries(*args, **kwargs))
 
     @classmethod
     def from_moedict(cls,
                      dictionary_path,
                      grapheme_key: str = "詞目",
                      phoneme_key: str = "音讀",
-                     stratum_key: str = "文白屬性"):
-        df = pd.read_csv(dictionary_path, dtype={grapheme_key: str, phoneme_key: str, stratum_key: str})
-        df = df.replace(np.nan, "", regex=True)
-        all_raw_entries = list(zip(df[grapheme_key], df[phoneme_key], df[stratum_key]))
-        all_entries = []
-        for raw_graph, raw_pron, raw_stratum in all_raw_entries: # prons = pronunciations
-            entries = list(product(raw_graph_to_all_graphs(raw_graph), raw_pron_to_all_prons(raw_pron),
-                                   [Stratum(int(raw_stratum))]))
-            all_entries.append(entries)
-
-        return cls([LexiconEntry(graph, 0.0, pron, stratum) for graph, pron, stratum in chain(*all_entries)])
+                     stratum_key: str = "文白屬性",
+                     num_workers: int = 1,
+                     chunksize: int = 10000):
+        """
+        Reads the dictionary `chunksize` rows at a time and, if `num_workers` > 1, normalizes
+        the graphemes and pronunciations of the chunks in that many processes.
+        """
+        chunks = read_csv_in_chunks(dictionary_path, [grapheme_key, phoneme_key, stratum_key], chunksize)
+        triples = map_chunks(moedict_rows_to_triples, chunks, num_workers)
+        return cls([LexiconEntry(graph, 0.0, pron, stratum) for graph, pron, stratum in chain(*triples)])
 
     @classmethod
     def from_hakka_dict(cls,
@@ -217,3 +549,217 @@ class Lexicon(dict):
             all_entries.append(entries)
 
         return cls([LexiconEntry(graph, 0.0, pron, Stratum.白) for graph, pron in chain(*all_entries)])
+
+
+def align(n: int, alignment: int = 8) -> int:
+    return -(-n // alignment) * alignment
+
+
+class StringPool:
+    """
+    Strings stored back to back as UTF-8 in one buffer, the `idx`-th one being
+    `data[offsets[idx]:offsets[idx+1]]`. `find` needs the strings to be sorted.
+    """
+    def __init__(self, data, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: List[str]):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_bytes(self, idx: int) -> bytes:
+        return bytes(self.data[self.offsets[idx]:self.offsets[idx+1]])
+
+    def __getitem__(self, idx: int) -> str:
+        return self.get_bytes(idx).decode('utf-8')
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def find(self, string: str) -> int:
+        # UTF-8 byte order is code point order, so the bytes can be compared directly
+        key = string.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.get_bytes(lo) == key:
+            return lo
+        return -1
+
+
+class CompactLexicon:
+    """
+    Read-only, column-oriented storage of a `Lexicon` with the same lookup API.
+
+    Graphemes are kept sorted in one `StringPool`, the entries of the `idx`-th grapheme
+    are rows `entry_offsets[idx]:entry_offsets[idx+1]` of the `probs`, `stratum_codes`,
+    `phoneme_ids` and `len_diffs` columns, and `phoneme_ids` point into a second
+    `StringPool` holding every distinct pronunciation once.
+    """
+    def __init__(self,
+                 graphemes: StringPool,
+                 phonemes: StringPool,
+                 entry_offsets: np.ndarray,
+                 probs: np.ndarray,
+                 stratum_codes: np.ndarray,
+                 phoneme_ids: np.ndarray,
+                 len_diffs: np.ndarray):
+        self.graphemes = graphemes
+        self.phonemes = phonemes
+        self.entry_offsets = entry_offsets
+        self.probs = probs
+        self.stratum_codes = stratum_codes
+        self.phoneme_ids = phoneme_ids
+        self.len_diffs = len_diffs
+
+    @classmethod
+    def from_lexicon(cls, lexicon: Lexicon):
+        graphemes = sorted(lexicon)
+        phoneme_to_id = {}
+        probs, stratum_codes, phoneme_ids, len_diffs = [], [], [], []
+        entry_offsets = np.zeros(len(graphemes) + 1, dtype=np.int64)
+        for idx, grapheme in enumerate(graphemes):
+            entries = lexicon[grapheme]
+            entry_offsets[idx+1] = entry_offsets[idx] + len(entries)
+            for entry in entries:
+                probs.append(entry.prob)
+                stratum_codes.append(entry.stratum_code)
+                phoneme_ids.append(phoneme_to_id.setdefault(entry.phonemes, len(phoneme_to_id)))
+                len_diffs.append(lexicon.len_diff_heur(entry))
+        return cls(StringPool.from_strings(graphemes),
+                   StringPool.from_strings(list(phoneme_to_id)),
+                   entry_offsets,
+                   np.array(probs, dtype=np.float64),
+                   np.array(stratum_codes, dtype=np.int8),
+                   np.array(phoneme_ids, dtype=np.int32),
+                   np.array(len_diffs, dtype=np.int32))
+
+    MAGIC = b"TSMLEX01"
+    COLUMNS = {
+        "grapheme_data": "u1",
+        "grapheme_offsets": "<i8",
+        "phoneme_data": "u1",
+        "phoneme_offsets": "<i8",
+        "entry_offsets": "<i8",
+        "probs": "<f8",
+        "stratum_codes": "i1",
+        "phoneme_ids": "<i4",
+        "len_diffs": "<i4",
+    }
+
+    def _columns(self):
+        return {
+            "grapheme_data": np.frombuffer(self.graphemes.data, dtype=np.uint8),
+            "grapheme_offsets": self.graphemes.offsets,
+            "phoneme_data": np.frombuffer(self.phonemes.data, dtype=np.uint8),
+            "phoneme_offsets": self.phonemes.offsets,
+            "entry_offsets": self.entry_offsets,
+            "probs": self.probs,
+            "stratum_codes": self.stratum_codes,
+            "phoneme_ids": self.phoneme_ids,
+            "len_diffs": self.len_diffs,
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Layout: `MAGIC`, the length of a JSON header as a little-endian uint64, the header,
+        which maps every column to its (offset, length), and the columns, each 8-byte aligned.
+        """
+        columns = {name: np.ascontiguousarray(column, dtype=self.COLUMNS[name])
+                   for name, column in self._columns().items()}
+        # offsets in the header depend on its length, so lay the columns out relative to the
+        # end of the header and shift them once it's known
+        layout, position = {}, 0
+        for name, column in columns.items():
+            layout[name] = (position, len(column))
+            position += align(column.nbytes)
+        header = json.dumps(layout).encode('utf-8')
+        data_start = align(len(self.MAGIC) + 8 + len(header))
+        with open(path, 'wb') as fp:
+            fp.write(self.MAGIC)
+            fp.write(np.uint64(len(header)).tobytes())
+            fp.write(header)
+            for name, column in columns.items():
+                fp.seek(data_start + layout[name][0])
+                fp.write(column.tobytes())
+            fp.truncate(data_start + position)
+
+    @classmethod
+    def open_mmap(cls, path: str):
+        with open(path, 'rb') as fp:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError(f"{path} is not a compiled lexicon")
+        header_len = int(np.frombuffer(buffer, dtype="<u8", count=1, offset=len(cls.MAGIC))[0])
+        header_start = len(cls.MAGIC) + 8
+        layout = json.loads(buffer[header_start:header_start + header_len].decode('utf-8'))
+        data_start = align(header_start + header_len)
+        columns = {name: np.frombuffer(buffer, dtype=cls.COLUMNS[name], count=length,
+                                       offset=data_start + offset)
+                   for name, (offset, length) in layout.items()}
+        return cls(StringPool(memoryview(columns["grapheme_data"]), columns["grapheme_offsets"]),
+                   StringPool(memoryview(columns["phoneme_data"]), columns["phoneme_offsets"]),
+                   columns["entry_offsets"],
+                   columns["probs"],
+                   columns["stratum_codes"],
+                   columns["phoneme_ids"],
+                   columns["len_diffs"])
+
+    def _span(self, word: str) -> slice:
+        idx = self.graphemes.find(word)
+        if idx < 0:
+            raise KeyError(word)
+        return slice(int(self.entry_offsets[idx]), int(self.entry_offsets[idx+1]))
+
+    def _entry(self, grapheme: str, row: int) -> LexiconEntry:
+        return LexiconEntry(grapheme, float(self.probs[row]), self.phonemes[self.phoneme_ids[row]],
+                            int(self.stratum_codes[row]))
+
+    def __contains__(self, word) -> bool:
+        return isinstance(word, str) and self.graphemes.find(word) >= 0
+
+    def __getitem__(self, word: str) -> List[LexiconEntry]:
+        span = self._span(word)
+        return [self._entry(word, row) for row in range(span.start, span.stop)]
+
+    def __iter__(self):
+        return iter(self.graphemes)
+
+    def __len__(self):
+        return len(self.graphemes)
+
+    def get_most_probable(self, word):
+        span = self._span(word)
+        return self._entry(word, span.start + int(np.argmax(self.probs[span])))
+
+    def get_nbest(self, word, n_best, filter_func=None, strata: Iterable[Stratum] = None):
+        span = self._span(word)
+        # lexsort is stable, so ties keep the order `Lexicon.get_nbest` keeps them in
+        order = np.lexsort((self.len_diffs[span], -self.probs[span]))
+        if strata is not None:
+            codes = [stratum.value for stratum in strata]
+            order = order[np.isin(self.stratum_codes[span][order], codes)]
+        if filter_func is None:
+            return [self._entry(word, span.start + int(row)) for row in order[:n_best]]
+        nbest = []
+        for row in order:
+            entry = self._entry(word, span.start + int(row))
+            if filter_func(entry):
+                nbest.append(entry)
+                if len(nbest) == n_best:
+                    break
+        return nbest
+
+    def get_oovs(self, maybe_oov_words: List[str]):
+        return list(filter(lambda word: word not in self, maybe_oov_words))
@@ -0,0 +1,262 @@
+from concurrent.futures import Future
+from http.server import HTTPServer, ThreadingHTTPServer
+from typing import List
+import logging
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+
+class ModelHTTPServer(HTTPServer):
+    """
+    `HTTPServer` whose handlers read the models of the serving worker, such as
+    `TaigiModels`, from `self.server.models`.
+    """
+    models = None
+
+
+class WorkerPoolHTTPServer(ModelHTTPServer):
+    """
+    Hands accepted connections to `num_workers` threads, each of which calls `load_models`
+    once on start and keeps the result for every request it serves, so one slow parse
+    only holds up its own worker. The constructor returns once every worker has loaded
+    its models, and raises the error of the first `load_models` call that failed.
+    `server_close` lets the workers finish the queued requests before joining them.
+
+    Requests for `inline_paths` are answered on the accepting thread instead, so health
+    checks don't wait behind slow parses; their handlers must not use `self.server.models`.
+    """
+    inline_paths = ("/health",)
+    # how long to wait for the request line before queueing the connection anyway
+    peek_timeout = 0.1
+
+    def __init__(self, server_address, handler_class, num_workers, load_models):
+        super().__init__(server_address, handler_class)
+        self._local = threading.local()
+        self._requests = queue.Queue()
+        loaded = [Future() for _ in range(num_workers)]
+        self._workers = [threading.Thread(target=self._work, args=(load_models, ready), daemon=True)
+                         for ready in loaded]
+        for worker in self._workers:
+            worker.start()
+        try:
+            for ready in loaded:
+                ready.result()
+        except BaseException:
+            self.server_close()
+            raise
+
+    @property
+    def models(self):
+        return self._local.models
+
+    def _work(self, load_models, ready):
+        try:
+            self._local.models = load_models()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def _is_inline(self, request) -> bool:
+        request.settimeout(self.peek_timeout)
+        try:
+            head = request.recv(1024, socket.MSG_PEEK)
+        except OSError:
+            return False
+        finally:
+            request.settimeout(None)
+        method, _, rest = head.partition(b" ")
+        path = rest.split(b" ", 1)[0].split(b"?", 1)[0]
+        return method in (b"GET", b"HEAD") and path.decode('latin-1') in self.inline_paths
+
+    def process_request(self, request, client_address):
+        if self._is_inline(request):
+            super().process_request(request, client_address)
+        else:
+            self._requests.put((request, client_address))
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class MicroBatcher:
+    """
+    Collects the sentences of concurrent requests into micro-batches of at most
+    `max_batch_size`, waiting at most `max_wait_ms` after the first one arrives, and runs
+    each micro-batch through `TaigiModels.parse_batch` on one of `num_workers` threads,
+    each holding its own models. Has the same `parse` / `parse_batch` interface as `TaigiModels`.
+    Like `WorkerPoolHTTPServer`, the constructor waits for the models of every worker and
+    raises the error of the first `load_models` call that failed.
+    """
+    def __init__(self, load_models, num_workers=1, max_batch_size=32, max_wait_ms=5.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        loaded = [Future() for _ in range(num_workers)]
+        self._workers = [threading.Thread(target=self._work, args=(load_models, ready), daemon=True)
+                         for ready in loaded]
+        for worker in self._workers:
+            worker.start()
+        try:
+            for ready in loaded:
+                ready.result()
+        except BaseException:
+            self.close()
+            raise
+
+    def submit(self, src_sent) -> Future:
+        future = Future()
+        self._queue.put((src_sent, future))
+        return future
+
+    def parse(self, src_sent):
+        return self.submit(src_sent).result()
+
+    def parse_batch(self, src_sents):
+        futures = [self.submit(src_sent) for src_sent in src_sents]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _work(self, load_models, ready):
+        try:
+            models = load_models()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            logging.info(f"parsing a micro-batch of {len(batch)} sentences")
+            try:
+                results = models.parse_batch([src_sent for src_sent, _ in batch])
+            except Exception:
+                # don't let one bad sentence fail the others in its batch
+                for src_sent, future in batch:
+                    try:
+                        future.set_result(models.parse(src_sent))
+                    except Exception as e:
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class MicroBatchingHTTPServer(ThreadingHTTPServer):
+    """
+    Handles every connection on its own thread; handlers hand their sentences to a shared
+    `MicroBatcher` through `self.server.models`. `server_close` waits for open requests.
+    """
+    daemon_threads = False
+
+    def __init__(self, server_address, handler_class, batcher):
+        super().__init__(server_address, handler_class)
+        self.models = batcher
+
+    def server_close(self):
+        super().server_close()
+        self.models.close()
+
+
+def shutdown_on_signals(server):
+    # `shutdown` waits for `serve_forever` to return, so it can't run on the serving thread
+    def handler(signum, frame):
+        logging.info(f"received signal {signum}, shutting down")
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def fork_workers(server: ModelHTTPServer, num_workers: int, load_models) -> List[int]:
+    """
+    Forks `num_workers` processes that each call `load_models` and then serve `server`, and
+    returns their pids once all of them have loaded their models. If one of them fails to,
+    the others are terminated and `RuntimeError` is raised, as `WorkerPoolHTTPServer` does.
+    """
+    pids, ready_fds = [], []
+    for _ in range(num_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 1
+            try:
+                shutdown_on_signals(server)
+                server.models = load_models()
+                os.write(write_fd, b"1")
+                os.close(write_fd)
+                server.serve_forever()
+                server.server_close()
+                status = 0
+            except BaseException:
+                logging.exception("worker %d failed", os.getpid())
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        pids.append(pid)
+        ready_fds.append(read_fd)
+
+    # a worker that dies before writing to its pipe closes it, so the read sees end of file
+    num_failed = 0
+    for read_fd in ready_fds:
+        num_failed += not os.read(read_fd, 1)
+        os.close(read_fd)
+    if num_failed:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        wait_workers(pids)
+        raise RuntimeError(f"{num_failed} of {num_workers} workers failed to load their models")
+    return pids
+
+
+def wait_workers(pids: List[int]) -> None:
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code != 0:
+            logging.error("worker %d exited with %d", pid, exit_code)
@@ -4,17 +4,22 @@ from tqdm import tqdm
 import logging
 import json
 import re
+import os
+import signal
+from functools import partial
 from json.decoder import JSONDecodeError
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler
 
 import nltk
-import benepar
 import zhon.hanzi
 
-from clients import MosesClient
+# `tsm.clients` needs the `tsm` package anyway, so it's imported from there rather than next to the script
+from tsm.clients import MosesClient
+from tsm.model_server import ModelHTTPServer, WorkerPoolHTTPServer, MicroBatcher, MicroBatchingHTTPServer
+from tsm.model_server import fork_workers, wait_workers, shutdown_on_signals
 
 zh_char = f"[{zhon.hanzi.punctuation}]|[{zhon.hanzi.characters}]"
-en_word = "[A-Za-z'\-]+" 
+en_word = "[A-Za-z'\-]+"
 zh_char_en_word = f"{zh_char}|{en_word}"
 
 class Tokenizer:
@@ -28,36 +33,126 @@ class Tokenizer:
         return tokenized_surfaces
 
 
+class BeneparParser:
+    def __init__(self, model="benepar_zh2"):
+        import benepar
+        self.benepar = benepar
+        self.parser = benepar.Parser(model)
+
+    def parse_sents(self, sents):
+        """
+        Parses pre-tokenized `sents`, lists of words, in one call.
+        """
+        return self.parser.parse_sents([self.benepar.InputSentence(words=tokens) for tokens in sents])
+
+
+class TaigiModels:
+    """
+    Everything a worker needs to answer a request: a Moses `client` translating to Mandarin,
+    a `cutter` tokenizing the translations and an `nl_parser` parsing them. Loaded once per
+    worker by `load`.
+    """
+    def __init__(self, client, cutter, nl_parser):
+        self.client = client
+        self.cutter = cutter
+        self.nl_parser = nl_parser
+
+    @classmethod
+    def load(cls, ckpt_path):
+        nl_parser = BeneparParser()
+        client = MosesClient(config={})
+        print("done loading parser")
+        cutter = Tokenizer(ckpt_path)
+        print("done initializing word segmentation module")
+        return cls(client, cutter, nl_parser)
+
+    def translate(self, src_sent):
+        src_char_sent = " ".join(re.findall(zh_char_en_word, src_sent))
+        translation_result = self.client.translate(src_char_sent)
+        alignment = [(align['source-word'], align['target-word']) for align in translation_result['word-align']]
+        tgt_char_sent = translation_result['text']
+        return src_char_sent, tgt_char_sent, alignment
+
+    def parse(self, src_sent):
+        return self.parse_batch([src_sent])[0]
+
+    def parse_batch(self, src_sents):
+        """
+        One Moses call per sentence, then a single tokenizer call and a single
+        `parse_sents` call for all of them.
+        """
+        translations = [self.translate(src_sent) for src_sent in src_sents]
+        tgt_sents = [re.sub(f" ?({zh_char}) ?", r"\1", tgt_char_sent) for _, tgt_char_sent, _ in translations]
+        tgt_tokens = self.cutter.tokenize(tgt_sents)
+        tgt_trees = self.nl_parser.parse_sents(tgt_tokens)
+        return [{"source": src_char_sent, "target": tgt_char_sent, "tree": str(tgt_tree), "alignment": alignment}
+                for (src_char_sent, tgt_char_sent, alignment), tgt_tree in zip(translations, tgt_trees)]
+
+
 class TaigiServer(BaseHTTPRequestHandler):
-    def _set_response(self):
-        self.send_response(200)
+    def _set_response(self, code=200):
+        self.send_response(code)
         self.send_header('Content-type', 'text/json')
         self.end_headers()
 
+    def do_GET(self):
+        if self.path == "/health":
+            self._set_response()
+            self.wfile.write(json.dumps({"status": "ok", "pid": os.getpid()}).encode('utf-8'))
+        else:
+            self._set_response(404)
+
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length).decode('utf-8')
         logging.info("POST request,\nPath: %s\nHeaders:\n%s\n\nBody:\n%s\n",
                 str(self.path), str(self.headers), post_data)
         try:
-            src_sent = json.loads(post_data)['sentence']
-            src_char_sent = " ".join(re.findall(zh_char_en_word, src_sent))
-            translation_result = client.translate(src_char_sent)
-            alignment = [(align['source-word'], align['target-word']) for align in translation_result['word-align']]
-            tgt_char_sent = translation_result['text']
-            tgt_sent = re.sub(f" ?({zh_char}) ?", r"\1", tgt_char_sent)
-            tgt_tokens = cutter.tokenize([tgt_sent])[0]
-            benepar_tgt_sent = benepar.InputSentence(words=tgt_tokens)
-            tgt_tree = nl_parser.parse(benepar_tgt_sent)
+            if self.path == "/parse_batch":
+                src_sents = json.loads(post_data)['sentences']
+                result = self.server.models.parse_batch(src_sents)
+            else:
+                src_sent = json.loads(post_data)['sentence']
+                result = self.server.models.parse(src_sent)
             self._set_response()
-            self.wfile.write(json.dumps({"source": src_char_sent, "target": tgt_char_sent, "tree": str(tgt_tree), "alignment": alignment}).encode('utf-8'))
+            self.wfile.write(json.dumps(result).encode('utf-8'))
         except JSONDecodeError:
             print(f"cannot read post_data {post_data}")
-            self.send_response(400)
-            self.send_header('Content-type', 'text/json')
-            self.end_headers()
+            self._set_response(400)
+
+
+def serve_threaded(server_address, num_workers, load_models):
+    server = WorkerPoolHTTPServer(server_address, TaigiServer, num_workers, load_models)
+    shutdown_on_signals(server)
+    print(f"serving at {server_address[0]}:{server_address[1]} with {num_workers} threads")
+    server.serve_forever()
+    server.server_close()
+
+
+def serve_micro_batched(server_address, num_workers, load_models, max_batch_size, max_wait_ms):
+    batcher = MicroBatcher(load_models, num_workers, max_batch_size, max_wait_ms)
+    server = MicroBatchingHTTPServer(server_address, TaigiServer, batcher)
+    shutdown_on_signals(server)
+    print(f"serving at {server_address[0]}:{server_address[1]} with {num_workers} threads, "
+          f"micro-batches of up to {max_batch_size} sentences within {max_wait_ms}ms")
+    server.serve_forever()
+    server.server_close()
+
 
+def serve_preforked(server_address, num_workers, load_models):
+    server = ModelHTTPServer(server_address, TaigiServer)
+    try:
+        pids = fork_workers(server, num_workers, load_models)
+    finally:
+        server.socket.close()
 
+    def forward(signum, frame):
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    print(f"serving at {server_address[0]}:{server_address[1]} with {num_workers} processes")
+    wait_workers(pids)
 
 
 if __name__ == '__main__':
@@ -65,14 +160,21 @@ if __name__ == '__main__':
     parser.add_argument('--ckpt-path')
     parser.add_argument('--host-name')
     parser.add_argument('--port', default="8000")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--worker-type', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--micro-batch', action='store_true',
+                        help='batch concurrent requests together before parsing them')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
     args = parser.parse_args()
+    if args.micro_batch and args.worker_type == 'process':
+        parser.error("--micro-batch needs --worker-type thread")
 
-    global cutter, client, nl_parser
-    nl_parser = benepar.Parser("benepar_zh2")
-    client = MosesClient(config={})
-    print("done loading parser")
-    cutter = Tokenizer(args.ckpt_path)
-    print("done initializing word segmentation module")
-    webServer = HTTPServer((args.host_name, int(args.port)), TaigiServer)
-    webServer.serve_forever()
-    print(f"serving at {args.host_name}:{args.port}")
+    server_address = (args.host_name, int(args.port))
+    load_models = partial(TaigiModels.load, args.ckpt_path)
+    if args.micro_batch:
+        serve_micro_batched(server_address, args.workers, load_models, args.max_batch_size, args.max_wait_ms)
+    elif args.worker_type == 'process':
+        serve_preforked(server_address, args.workers, load_models)
+    else:
+        serve_threaded(server_address, args.workers, load_models)
@@ -0,0 +1,104 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class TrieNode:
+    __slots__ = ("children", "is_key")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.is_key = False
+
+
+class Trie:
+    """
+    Character trie over a set of strings, answering which keys are prefixes of a text
+    at a given position in time proportional to the longest match rather than the text.
+    """
+    def __init__(self, keys: Iterable[str] = ()):
+        self.root = TrieNode()
+        # not lowered by `discard`, so only an upper bound on the length of the keys
+        self.max_len = 0
+        self._len = 0
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str) -> None:
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, TrieNode())
+        if not node.is_key:
+            node.is_key = True
+            self._len += 1
+            self.max_len = max(self.max_len, len(key))
+
+    def discard(self, key: str) -> None:
+        path = [self.root]
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        if not path[-1].is_key:
+            return
+        path[-1].is_key = False
+        self._len -= 1
+        # prune the nodes left without keys below them
+        for char, parent, node in zip(reversed(key), reversed(path[:-1]), reversed(path[1:])):
+            if node.is_key or node.children:
+                break
+            del parent.children[char]
+
+    def __contains__(self, key: str) -> bool:
+        node = self.root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return False
+        return node.is_key
+
+    def __len__(self):
+        return self._len
+
+    def prefix_ends(self, text: str, start: int = 0, stop: int = None) -> List[int]:
+        """
+        The end positions `end` <= `stop`, in increasing order, of the keys `text[start:end]`.
+        """
+        ends = []
+        node = self.root
+        stop = len(text) if stop is None else min(stop, len(text))
+        for end in range(start, stop):
+            node = node.children.get(text[end])
+            if node is None:
+                break
+            if node.is_key:
+                ends.append(end + 1)
+        return ends
+
+    def prefixes(self, text: str, start: int = 0) -> List[str]:
+        """
+        The keys that `text[start:]` starts with, shortest first.
+        """
+        return [text[start:end] for end in self.prefix_ends(text, start)]
+
+    def longest_prefix(self, text: str, start: int = 0) -> Optional[str]:
+        ends = self.prefix_ends(text, start)
+        return text[start:ends[-1]] if ends else None
+
+    def keys(self, prefix: str = "") -> Iterator[str]:
+        """
+        The keys starting with `prefix`, in sorted order.
+        """
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return
+        stack = [(prefix, node)]
+        while stack:
+            key, node = stack.pop()
+            if node.is_key:
+                yield key
+            stack.extend((key + char, child) for char, child in sorted(node.children.items(), reverse=True))
+
+    def __iter__(self):
+        return self.keys()
@@ -1,9 +1,12 @@
-from typing import List, Dict, Tuple, Iterable, Union
-from itertools import product, accumulate, groupby
-from functools import lru_cache
+from typing import List, Dict, Tuple, Iterable, Union, BinaryIO, Hashable
+from itertools import product, accumulate, groupby, count
 from collections import defaultdict
 import re
+import heapq
 import logging
+import gzip
+import bz2
+import lzma
 
 import unicodedata
 from nltk.tree import Tree
@@ -14,21 +17,33 @@ from tsm.symbols import 臺灣閩南語羅馬字拼音韻母表
 from 臺灣言語工具.基本物件.公用變數 import 分字符號, 分詞符號
 from tsm.symbols import iNULL, TONES, is_phn, all_syls
 from tsm.POJ_TL import poj_tl
+from tsm.dict_segmenter import DictSegmenter
+from tsm.array_tree import ArrayTree
 
 flatten = lambda l: [item for sublist in l for item in sublist]
 
 
-def is_preterminal(t: Tree):
+def is_preterminal(t: Union[Tree, ArrayTree], node: int = 0):
+    if isinstance(t, ArrayTree):
+        return t.is_preterminal(node)
     return all(map(lambda c: isinstance(c, str), t))
 
-def path_compression(dictionary: Dict[Tuple[int], Tuple[int]]):
+def path_compression(dictionary: Dict[Hashable, Hashable]):
+    """
+    Maps every key to the end of its chain of values, e.g. phrase positions or `ArrayTree`
+    node ids to their lexical heads. Each chain is followed once.
+    """
     dictionary_compressed = {}
     for key in dictionary:
+        chain = [key]
         value = dictionary[key]
-        while dictionary.get(value):
+        while value in dictionary and value not in dictionary_compressed:
+            chain.append(value)
             value = dictionary[value]
-        dictionary_compressed[key] = value
-    return dictionary_compressed
+        value = dictionary_compressed.get(value, value)
+        for chained_key in chain:
+            dictionary_compressed[chained_key] = value
+    return {key: dictionary_compressed[key] for key in dictionary}
 
 def get_label(maybe_tree: Union[Tree, str]) -> str:
     if isinstance(maybe_tree, Tree):
@@ -108,6 +123,30 @@ def read_file_to_lines(filename: str, unicode_escape=False) -> List[str]:
             lines = fp.read().splitlines()
     return lines
 
+COMPRESSION_MAGICS = [
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+]
+
+def compression_opener(filename: str):
+    """
+    The function that opens `filename` if it's gzip, bz2 or xz compressed, otherwise `None`.
+    """
+    with open(filename, 'rb') as fp:
+        magic = fp.read(6)
+    for prefix, opener in COMPRESSION_MAGICS:
+        if magic.startswith(prefix):
+            return opener
+    return None
+
+def open_maybe_compressed(filename: str) -> BinaryIO:
+    """
+    Opens `filename` for reading bytes, decompressing gzip, bz2 and xz files on the fly.
+    """
+    opener = compression_opener(filename) or open
+    return opener(filename, 'rb')
+
 def write_lines_to_file(filename: str, lines: List[str]) -> None:
     with open(filename, 'w') as fp:
         for line in lines:
@@ -204,44 +243,13 @@ def g2p(lexicon: Dict[str, List[str]], sentence: List[str]) -> List[List[str]]:
             logging.warning(f"{word} has no entry in lexicon")
     return phonemes
 
-def dfs_factory(backtrack):
-
-    @lru_cache(maxsize=None)
-    def dfs(idx):
-        if idx > 0:
-            paths = []
-            for pred_idx in backtrack[idx]:
-                paths += [[idx] + path for path in dfs(pred_idx)]
-            return paths
-        else:
-            return [[0]]
-
-    return dfs
-
-def build_sent(sent, backtrack):
-    my_dfs = dfs_factory(backtrack)
-    list_cuts = my_dfs(len(sent))
-    sents = []
-    for cuts in list_cuts:
-        cuts = list(reversed(cuts))
-        words = []
-        for s, e in zip(cuts[:-1], cuts[1:]):
-            words.append(sent[s:e])
-        sents.append(words)
-    return sents
-
-def dict_seg(sent, wordDict):
-    min_cuts = [0] + [len(sent) * (idx + 1) for idx, _ in enumerate(sent)]
-    backtrack = [[]] + [[idx] for idx in range(len(sent))]
-    for i in range(1,len(sent)+1):
-        for j in range(0, i):
-            if sent[j:i] in wordDict:
-                if min_cuts[j] + 1 == min_cuts[i]:
-                    backtrack[i].append(j)
-                elif min_cuts[j] + 1 < min_cuts[i]:
-                    min_cuts[i] = min_cuts[j] + 1
-                    backtrack[i] = [j]
-    return build_sent(sent, backtrack)
+def dict_seg(sent, wordDict, max_word_len: int = None):
+    """
+    Every segmentation of `sent` into the fewest words of `wordDict`, see `DictSegmenter`.
+    Pass a `Lexicon` or `Trie` as `wordDict` to avoid indexing it on every call, or use
+    `DictSegmenter.segment` / `segmentations` directly for the best or a lazy stream of cuts.
+    """
+    return list(DictSegmenter(wordDict, max_word_len).segmentations(sent))
 
 def char2bpmf(char):
     from pypinyin import pinyin, Style
@@ -295,11 +303,22 @@ def maybe_add_tone(syl_tone):
             raise ValueError
     return f"{syl}{tone}"
 
+CANONICAL_TL_RE = re.compile(r"[a-z0-9 \-]*")
+POJ_ONLY_RE = re.compile(r"ch|ou|oa|oe|eng|ek|hnn")
+
+def is_canonical_tl(pron: str) -> bool:
+    """
+    Whether lowercased `pron` is plain numbered TL that the POJ-to-TL conversion would leave as is:
+    no tone marks or other non-ASCII letters, and none of the spellings that conversion rewrites.
+    """
+    return CANONICAL_TL_RE.fullmatch(pron) is not None and POJ_ONLY_RE.search(pron) is None
+
 def process_pron(pron):
     pron = pron.lower()
-    pron = unicodedata.normalize("NFKC", pron)
-    pron = re.sub("ı", "i", pron) # replace the dotless i to normal i
-    pron = poj_tl(pron).tlt_tls().pojs_tls()
+    if not is_canonical_tl(pron):
+        pron = unicodedata.normalize("NFKC", pron)
+        pron = re.sub("ı", "i", pron) # replace the dotless i to normal i
+        pron = poj_tl(pron).tlt_tls().pojs_tls()
     raw_syls = filter(lambda syl: syl, re.split('[\W\-]+', pron.strip()))
     try:
         syls = list(map(maybe_add_tone, raw_syls))
@@ -321,8 +340,80 @@ def group(objs, key):
         dictionary[key(obj)].append(obj)
     return dictionary
 
-def get_all_possible_translations(possible_cuts, lexicon):
-    return flatten([product(*[[entry.phonemes for entry in lexicon[word]] for word in cut]) for cut in possible_cuts])
+def get_all_possible_translations(possible_cuts, lexicon, k: int = None):
+    """
+    Pronunciations of `possible_cuts` as tuples of phonemes, one per word: all of them if `k`
+    is None, otherwise the `k` most probable, see `kbest_translations`. The k-best search runs
+    over the words of all the cuts at once, so it also follows paths switching from one cut to
+    another at a common position; for the cuts of `dict_seg` these are cuts themselves.
+    """
+    if k is None:
+        return flatten([product(*[[entry.phonemes for entry in lexicon[word]] for word in cut]) for cut in possible_cuts])
+    if not possible_cuts:
+        return []
+    sent = "".join(possible_cuts[0])
+    ends = [set() for _ in sent]
+    for cut in possible_cuts:
+        start = 0
+        for word in cut:
+            ends[start].add(start + len(word))
+            start += len(word)
+    return [phonemes for _, phonemes in kbest_translations(sent, lexicon, k, [sorted(word_ends) for word_ends in ends])]
+
+def kbest_translations(sent: str, lexicon, k: int, ends: List[List[int]] = None) -> List[Tuple[float, Tuple[str]]]:
+    """
+    The `k` most probable pronunciations of `sent` as (log prob, phonemes), one phonemes per
+    word, best first, where the log prob of a pronunciation is the sum of `LexiconEntry.prob`
+    of its words. The words are `sent[start:end]` for each `end` in `ends[start]`, by default
+    those of the best segmentations of `sent` by `DictSegmenter`, and words `lexicon` has no
+    pronunciation for are left out.
+
+    Runs over the lattice of character positions keeping the k best partial pronunciations
+    of each, so it takes O(n * L * k) time and O(n * k) space even when the number of
+    segmentations grows exponentially with the length n of `sent`.
+    """
+    ranked = getattr(lexicon, "ranked", None)
+    num_chars = len(sent)
+    if ends is None:
+        ends = DictSegmenter(lexicon).lattice(sent)
+    incoming = [[] for _ in range(num_chars + 1)]
+    for start, word_ends in enumerate(ends):
+        for end in word_ends:
+            word = sent[start:end]
+            if word in lexicon:
+                entries = ranked(word).entries if ranked else sorted(lexicon[word], key=lambda e: -e.prob)
+                incoming[end].append((start, entries[:k]))
+
+    # (log prob, start of the last word, rank of the hypothesis at that start, phonemes of the last word)
+    hyps = [[] for _ in range(num_chars + 1)]
+    hyps[0].append((0.0, None, None, None))
+    counter = count()
+    for pos in range(1, num_chars + 1):
+        # best-first over the (hypothesis at start) x (pronunciation of the word) grid of every
+        # incoming word, both sorted; among ties longer words, which are pushed first, come first
+        frontier = []
+        for start, entries in incoming[pos]:
+            if hyps[start] and entries:
+                heapq.heappush(frontier, (-(hyps[start][0][0] + entries[0].prob), next(counter), start, 0, entries, 0))
+        while frontier and len(hyps[pos]) < k:
+            _, _, start, rank, entries, idx = heapq.heappop(frontier)
+            hyps[pos].append((hyps[start][rank][0] + entries[idx].prob, start, rank, entries[idx].phonemes))
+            # every cell is pushed once: from its left neighbour, or from above in the first column
+            if idx == 0 and rank + 1 < len(hyps[start]):
+                heapq.heappush(frontier, (-(hyps[start][rank + 1][0] + entries[0].prob), next(counter),
+                                          start, rank + 1, entries, 0))
+            if idx + 1 < len(entries):
+                heapq.heappush(frontier, (-(hyps[start][rank][0] + entries[idx + 1].prob), next(counter),
+                                          start, rank, entries, idx + 1))
+
+    kbest = []
+    for score, start, rank, phonemes in hyps[num_chars]:
+        path = []
+        while start is not None:
+            path.append(phonemes)
+            _, start, rank, phonemes = hyps[start][rank]
+        kbest.append((score, tuple(reversed(path))))
+    return kbest
 
 def match_replace(sent, match, repl):
     start, end = match.span()